@@ -1,19 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, has_request_context
 import os
 os.makedirs('/var/data', exist_ok=True)
 
 
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
+from markupsafe import Markup
 import datetime
 import json
+import time
 import os
 # Add this import at the top of app.py
 from mcq import register_mcq_routes
 from flask import Flask
 from test import test_bp   # Import the test blueprint (replace with your module name)
 from dynamic_db_handler import GOALS
-from dynamic_db_handler import GOALS, get_goal_qbank_subjects
+from dynamic_db_handler import GOALS, get_goal_qbank_subjects, highlight_snippet
 
 
   # at top of app.py [file:488]
@@ -41,6 +43,26 @@ except ImportError:
 USER_DB_FILE = '/var/data/admin_users.db'
 DB_FILE = '/var/data/1st_year.db'
 
+# Bookmarks page size, and how many ids go into one WHERE id IN (...) query
+# (SQLite's default host-parameter limit is 999)
+BOOKMARKS_PAGE_SIZE = 50
+SQLITE_MAX_IN_PARAMS = 900
+
+# Topics that DON'T require login (free content for everyone). Seeds the
+# free_content_policy table in admin_users.db, which is what gets applied.
+DEFAULT_FREE_TOPICS = [
+    ('Anatomy', 'Basic Anatomy'),
+    ('Anatomy', 'General Anatomy'),
+    ('Physiology', 'Basic Physiology'),
+    ('Physiology', 'Cardiovascular System'),
+    ('Biochemistry', 'Carbohydrates'),
+    ('Biochemistry', 'Proteins'),
+    ('Pathology', 'General Pathology'),
+    ('Pathology', 'Cell Injury'),
+    ('Pharmacology', 'General Pharmacology'),
+    ('Pharmacology', 'Basic Pharmacokinetics')
+]
+
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
 print("Registered endpoints:")
@@ -65,10 +87,8 @@ def set_goal():
         flash("Invalid goal selected", 'error')
     return redirect(url_for('home'))
 def get_user_db_connection():
-    """ONLY connection function for ALL user operations"""
-    conn = sqlite3.connect(USER_DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """ONLY connection function for ALL user operations (pooled)"""
+    return dynamic_db_handler.get_connection(USER_DB_FILE)
 
 def get_db_connection():
     """Redirect ALL user operations to centralized database"""
@@ -147,6 +167,37 @@ def create_centralized_user_database():
         )
     ''')
     
+    # Bookmark pages are read newest first per user (keyset on created_at, id)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_bookmarks_user_created
+        ON user_bookmarks (user_id, created_at, id)
+    ''')
+    
+    # Note lookups are always by (user_id, question_id)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_notes_user_question
+        ON user_notes (user_id, question_id)
+    ''')
+    
+    # Free content policy - topics open to everyone (see setup_free_content)
+    policy_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='free_content_policy'"
+    ).fetchone()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS free_content_policy (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(subject, topic)
+        )
+    ''')
+    if not policy_exists:
+        conn.executemany(
+            'INSERT OR IGNORE INTO free_content_policy (subject, topic) VALUES (?, ?)',
+            DEFAULT_FREE_TOPICS
+        )
+    
     # User study analytics - ALL study data centralized
     conn.execute('''
         CREATE TABLE IF NOT EXISTS user_analytics (
@@ -179,47 +230,85 @@ with app.app_context():
 # --------------------
 # FREE CONTENT MANAGEMENT FUNCTIONS
 # --------------------
+def get_free_content_policy():
+    """(subject, topic) pairs from the free_content_policy table"""
+    user_conn = get_user_db_connection()  # Always admin_users.db
+    try:
+        rows = user_conn.execute(
+            'SELECT subject, topic FROM free_content_policy ORDER BY id'
+        ).fetchall()
+        return [(row['subject'], row['topic']) for row in rows]
+    finally:
+        user_conn.close()
+
+# Seconds for all per-database policy UPDATEs; a database still running then
+# is reported as an error and its catalog entry follows the file's mtime
+FREE_CONTENT_SETUP_TIMEOUT = 120
+
+def apply_free_content_policy(db_file, free_topics):
+    """Rewrite is_premium for one qbank database in a single set-based UPDATE"""
+    started = time.perf_counter()
+    with dynamic_db_handler.connection(db_file, readonly=False) as conn:
+        conn.execute('DROP TABLE IF EXISTS temp.free_topics')
+        conn.execute('CREATE TEMP TABLE free_topics (subject TEXT, topic TEXT, PRIMARY KEY (subject, topic))')
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO temp.free_topics (subject, topic) VALUES (?, ?)',
+                [(subject.lower(), topic.lower()) for subject, topic in free_topics]
+            )
+            # Free topics -> 0, everything else -> 1; only rows that change are written
+            cursor = conn.execute('''
+                UPDATE qbank 
+                SET is_premium = new_flag.value
+                FROM (
+                    SELECT q.id,
+                           CASE WHEN f.subject IS NULL THEN 1 ELSE 0 END AS value
+                    FROM qbank q
+                    LEFT JOIN temp.free_topics f
+                      ON f.subject = LOWER(q.subject) AND f.topic = LOWER(q.topic)
+                ) AS new_flag
+                WHERE qbank.id = new_flag.id AND qbank.is_premium IS NOT new_flag.value
+            ''')
+            rows_changed = cursor.rowcount
+        finally:
+            conn.execute('DROP TABLE IF EXISTS temp.free_topics')
+
+    return rows_changed, (time.perf_counter() - started) * 1000
+
+def update_catalog_premium(db_file, free_topics):
+    """Write the applied policy through to the content catalog (caller thread only)"""
+    dynamic_db_handler.set_topic_premium(db_file, 1)
+    for subject, topic in free_topics:
+        dynamic_db_handler.set_topic_premium(db_file, 0, subject, topic)
+
 def setup_free_content():
-    """Mark specific topics as free access - all others require login"""
-    # Topics that DON'T require login (free content for everyone)
-    free_topics = [
-        ('Anatomy', 'Basic Anatomy'),
-        ('Anatomy', 'General Anatomy'),
-        ('Physiology', 'Basic Physiology'),
-        ('Physiology', 'Cardiovascular System'),
-        ('Biochemistry', 'Carbohydrates'),
-        ('Biochemistry', 'Proteins'),
-        ('Pathology', 'General Pathology'),
-        ('Pathology', 'Cell Injury'),
-        ('Pharmacology', 'General Pharmacology'),
-        ('Pharmacology', 'Basic Pharmacokinetics')
-    ]
-    
-    # Apply to all discovered databases
-    for category, databases in dynamic_db_handler.discovered_databases.items():
-        if category == 'qbank':
-            for db_info in databases:
-                try:
-                    conn = dynamic_db_handler.get_connection(db_info['file'])
-                    
-                    # First, mark ALL topics as requiring login (premium = 1)
-                    conn.execute('UPDATE qbank SET is_premium = 1')
-                    
-                    # Then mark only specific topics as free (premium = 0)
-                    for subject, topic in free_topics:
-                        conn.execute('''
-                            UPDATE qbank 
-                            SET is_premium = 0 
-                            WHERE LOWER(subject) = ? AND LOWER(topic) = ?
-                        ''', (subject.lower(), topic.lower()))
-                    
-                    conn.commit()
-                    conn.close()
-                except Exception as e:
-                    print(f"Error setting up content in {db_info['file']}: {e}")
-    
+    """Mark the policy's topics as free access - all others require login.
+
+    Databases are updated in parallel; the catalog is updated here afterwards,
+    since fan-out workers must not take the catalog lock. Returns one report
+    entry per database.
+    """
+    free_topics = get_free_content_policy()
+    qbank_files = dynamic_db_handler.goal_registry.get_files('qbank')
+
+    report = []
+    results = dynamic_db_handler.fan_out_map(
+        qbank_files, lambda db_file: apply_free_content_policy(db_file, free_topics),
+        timeout=FREE_CONTENT_SETUP_TIMEOUT)
+    for result in results:
+        if result.error:
+            print(f"Error setting up content in {result.db_file}: {result.error}")
+            report.append({'database': result.db_file, 'rows_changed': 0,
+                           'elapsed_ms': None, 'error': result.error})
+            continue
+        rows_changed, elapsed_ms = result.value
+        update_catalog_premium(result.db_file, free_topics)
+        report.append({'database': result.db_file, 'rows_changed': rows_changed,
+                       'elapsed_ms': round(elapsed_ms, 1), 'error': None})
+
+    report.sort(key=lambda entry: entry['database'])
     print(f"Content setup completed. {len(free_topics)} topics are free across all databases.")
-    return True
+    return report
 
 
 
@@ -228,28 +317,19 @@ def setup_free_content():
 def is_topic_login_required(subject, topic):
     """Check if a topic requires user login (returns True if login required)"""
     source_db = find_subject_database(subject)
-    try:
-        conn = dynamic_db_handler.get_connection(source_db)
-        result = conn.execute('''
-            SELECT DISTINCT is_premium 
-            FROM qbank 
-            WHERE LOWER(subject) = ? AND LOWER(topic) = ?
-            LIMIT 1
-        ''', (subject.lower(), topic.lower())).fetchone()
-        conn.close()
-        
-        # If is_premium = 1, login is required
-        # If is_premium = 0, topic is free
-        return result and result['is_premium'] == 1
-    except Exception as e:
-        print(f"Error checking topic access: {e}")
-        return True  # Default to requiring login
+    is_premium = dynamic_db_handler.get_topic_premium(source_db, subject, topic)
+    if is_premium is None:
+        return True  # Database unavailable - default to requiring login
+
+    # If is_premium = 1, login is required
+    # If is_premium = 0, topic is free
+    return is_premium == 1
 
 def mark_topic_as_login_required(subject, topic):
     """Mark a specific topic as requiring login (admin function)"""
     source_db = find_subject_database(subject)
     try:
-        conn = dynamic_db_handler.get_connection(source_db)
+        conn = dynamic_db_handler.get_connection(source_db, readonly=False)
         conn.execute('''
             UPDATE qbank 
             SET is_premium = 1 
@@ -257,6 +337,7 @@ def mark_topic_as_login_required(subject, topic):
         ''', (subject.lower(), topic.lower()))
         conn.commit()
         conn.close()
+        dynamic_db_handler.set_topic_premium(source_db, 1, subject, topic)
         return True
     except Exception as e:
         print(f"Error marking topic as login required: {e}")
@@ -266,7 +347,7 @@ def mark_topic_as_free(subject, topic):
     """Mark a specific topic as free access (admin function)"""
     source_db = find_subject_database(subject)
     try:
-        conn = dynamic_db_handler.get_connection(source_db)
+        conn = dynamic_db_handler.get_connection(source_db, readonly=False)
         conn.execute('''
             UPDATE qbank 
             SET is_premium = 0 
@@ -274,6 +355,7 @@ def mark_topic_as_free(subject, topic):
         ''', (subject.lower(), topic.lower()))
         conn.commit()
         conn.close()
+        dynamic_db_handler.set_topic_premium(source_db, 0, subject, topic)
         return True
     except Exception as e:
         print(f"Error marking topic as free: {e}")
@@ -320,73 +402,215 @@ def get_question_count(conn, subject_name, topic_name):
     ).fetchone()
     return result['count'] if result else 0
 
+class UserStateRepository:
+    """Bookmarks, notes and completed topics of one user, loaded in batches.
+
+    load() fetches everything for a set of question ids and subjects with one
+    query per table on a single pooled admin_users.db connection. Lookups for
+    items that were not loaded fall back to loading just that item.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._bookmarks = {}    # question_id -> bool
+        self._notes = {}        # question_id -> note text or None
+        self._completed = {}    # (LOWER(subject), source_db) -> set of topics
+
+    def load(self, question_ids=(), subjects=()):
+        """Batch-load state for question ids and (subject, source_db) pairs"""
+        question_ids = [qid for qid in dict.fromkeys(question_ids) if qid not in self._bookmarks]
+        subjects = [(subject.lower(), source_db) for subject, source_db in subjects
+                    if (subject.lower(), source_db) not in self._completed]
+
+        if not self.user_id:
+            for qid in question_ids:
+                self._bookmarks[qid] = False
+                self._notes[qid] = None
+            for key in subjects:
+                self._completed[key] = set()
+            return self
+
+        if not question_ids and not subjects:
+            return self
+
+        user_conn = get_user_db_connection()  # Always admin_users.db
+        try:
+            if question_ids:
+                placeholders = ','.join('?' * len(question_ids))
+                params = [self.user_id] + question_ids
+
+                bookmarked = {row['question_id'] for row in user_conn.execute(
+                    f'SELECT question_id FROM user_bookmarks WHERE user_id = ? AND question_id IN ({placeholders})',
+                    params
+                ).fetchall()}
+
+                notes = {}
+                for row in user_conn.execute(
+                    f'''SELECT question_id, note FROM user_notes 
+                        WHERE user_id = ? AND question_id IN ({placeholders}) ORDER BY id''',
+                    params
+                ).fetchall():
+                    notes.setdefault(row['question_id'], row['note'])
+
+                for qid in question_ids:
+                    self._bookmarks[qid] = qid in bookmarked
+                    self._notes[qid] = notes.get(qid)
+
+            if subjects:
+                for key in subjects:
+                    self._completed[key] = set()
+                conditions = ' OR '.join(['(LOWER(subject) = ? AND source_database = ?)'] * len(subjects))
+                params = [self.user_id] + [value for key in subjects for value in key]
+                for row in user_conn.execute(
+                    f'''SELECT LOWER(subject) AS subject, topic, source_database FROM user_topic_completion 
+                        WHERE user_id = ? AND ({conditions})''',
+                    params
+                ).fetchall():
+                    self._completed[(row['subject'], row['source_database'])].add(row['topic'])
+        finally:
+            user_conn.close()
+        return self
+
+    def is_bookmarked(self, question_id):
+        if question_id not in self._bookmarks:
+            self.load(question_ids=[question_id])
+        return self._bookmarks[question_id]
+
+    def get_note(self, question_id):
+        if question_id not in self._notes:
+            self.load(question_ids=[question_id])
+        return self._notes[question_id]
+
+    def completed_topics(self, subject, source_db):
+        key = (subject.lower(), source_db)
+        if key not in self._completed:
+            self.load(subjects=[(subject, source_db)])
+        return self._completed[key]
+
+    def is_topic_completed(self, subject, topic, source_db):
+        return topic in self.completed_topics(subject, source_db)
+
+def get_user_state(user_id=None):
+    """Per-request UserStateRepository (defaults to the logged-in user)"""
+    if user_id is None:
+        user_id = session.get('user_id')
+    if not has_request_context():
+        return UserStateRepository(user_id)
+    states = g.setdefault('user_states', {})
+    if user_id not in states:
+        states[user_id] = UserStateRepository(user_id)
+    return states[user_id]
+
+@app.context_processor
+def inject_user_state():
+    """Templates can use user_state.is_bookmarked(qid) etc. without extra queries"""
+    return {'user_state': get_user_state()}
+
 def is_bookmarked(conn_unused, user_id, question_id):
     """Check bookmark in centralized database (ignore conn parameter)"""
-    if not user_id:
-        return False
-    
-    user_conn = get_user_db_connection()  # Always admin_users.db
-    try:
-        result = user_conn.execute(
-            'SELECT id FROM user_bookmarks WHERE user_id = ? AND question_id = ?',
-            (user_id, question_id)
-        ).fetchone()
-        return result is not None
-    finally:
-        user_conn.close()
+    return get_user_state(user_id).is_bookmarked(question_id)
 
 def is_topic_completed(conn_unused, user_id, subject, topic):
     """Check completion in centralized database"""
-    if not user_id:
-        return False
-    
-    source_db = find_subject_database(subject)
-    user_conn = get_user_db_connection()  # Always admin_users.db
-    try:
-        result = user_conn.execute(
-            '''SELECT id FROM user_topic_completion 
-               WHERE user_id = ? AND LOWER(subject) = ? AND topic = ? AND source_database = ?''',
-            (user_id, subject.lower(), topic, source_db)
-        ).fetchone()
-        return result is not None
-    finally:
-        user_conn.close()
+    return get_user_state(user_id).is_topic_completed(subject, topic, find_subject_database(subject))
 
 def get_user_note(conn_unused, user_id, question_id):
     """Get note from centralized database"""
-    if not user_id:
-        return None
-    
-    user_conn = get_user_db_connection()  # Always admin_users.db
-    try:
-        result = user_conn.execute(
-            'SELECT note FROM user_notes WHERE user_id = ? AND question_id = ?',
-            (user_id, question_id)
-        ).fetchone()
-        return result['note'] if result else None
-    finally:
-        user_conn.close()
+    return get_user_state(user_id).get_note(question_id)
+
+def get_completed_topics(user_id, subject, source_db):
+    """All topics of a subject the user has completed, in one query"""
+    return get_user_state(user_id).completed_topics(subject, source_db)
+
+def get_subject_progress(user_id, subject_databases):
+    """{subject: (completed_topics, total_topics)} for {subject: source_db}.
+
+    Totals come from the content catalog; completions from a single
+    GROUP BY query on user_topic_completion.
+    """
+    completed = {}
+    if user_id:
+        user_conn = get_user_db_connection()  # Always admin_users.db
+        try:
+            for row in user_conn.execute(
+                '''SELECT LOWER(subject) AS subject, source_database, COUNT(*) AS count 
+                   FROM user_topic_completion 
+                   WHERE user_id = ? 
+                   GROUP BY LOWER(subject), source_database''',
+                (user_id,)
+            ).fetchall():
+                completed[(row['subject'], row['source_database'])] = row['count']
+        finally:
+            user_conn.close()
+
+    return {
+        subject: (completed.get((subject.lower(), source_db), 0),
+                  dynamic_db_handler.get_topic_total(source_db, subject))
+        for subject, source_db in subject_databases.items()
+    }
+
+def build_subject_outline(subject_name, user_id, source_db):
+    """Chapter -> topic tree with question counts, access and completion.
+
+    Content comes from the in-memory catalog; the only query is the user's
+    completed topics for the subject.
+    """
+    outline = dynamic_db_handler.get_subject_outline(source_db, subject_name)
+
+    # Counts and premium flags are per topic across chapters (as before)
+    topic_counts = {}
+    topic_premium = {}
+    for topics in outline.values():
+        for topic, info in topics.items():
+            topic_counts[topic] = topic_counts.get(topic, 0) + info['question_count']
+            if topic is not None:
+                key = topic.lower()
+                topic_premium[key] = max(topic_premium.get(key, 0), info['is_premium'])
+
+    completed_topics = get_completed_topics(user_id, subject_name, source_db)
+
+    chapters_with_topics = []
+    for chapter, topics in outline.items():
+        if not chapter:
+            continue
+        enhanced_topics = []
+        for topic_name in topics:
+            if not topic_name:
+                continue
+
+            question_count = topic_counts[topic_name]
+            topic_requires_login = topic_premium[topic_name.lower()] == 1
+            show_lock = topic_requires_login and not user_id  # Only show lock if login required AND user not logged in
+
+            # Generate a rating based on question count
+            if question_count >= 50:
+                rating = 4.8
+            elif question_count >= 30:
+                rating = 4.5
+            elif question_count >= 15:
+                rating = 4.2
+            elif question_count >= 5:
+                rating = 4.0
+            else:
+                rating = 3.8
+
+            enhanced_topics.append({
+                'name': topic_name,
+                'question_count': question_count,
+                'rating': rating,
+                'status': 'LOGIN REQUIRED' if show_lock else 'FREE',
+                'completed': topic_name in completed_topics,
+                'requires_login': show_lock  # This controls the lock icon
+            })
+
+        if enhanced_topics:
+            chapters_with_topics.append({
+                'chapter': chapter,
+                'topics': enhanced_topics
+            })
+
+    return chapters_with_topics
 
-def get_next_topic(conn, subject_name, current_topic):
-    """Get next topic sorted by CHAPTER first, then topic name"""
-    topics = conn.execute(
-        '''
-        SELECT DISTINCT topic 
-        FROM qbank 
-        WHERE LOWER(subject) = ? AND topic != "" AND topic != "None"
-        ORDER BY chapter ASC, topic ASC
-        ''',
-        (subject_name.lower(),)
-    ).fetchall()
-    
-    topic_list = [t['topic'] for t in topics]
-    try:
-        current_index = topic_list.index(current_topic)
-        if current_index < len(topic_list) - 1:
-            return topic_list[current_index + 1]
-    except ValueError:
-        pass
-    return None
 # CENTRALIZED DATABASE OPERATIONS
 # --------------------
 def add_bookmark_to_db(user_id, question_id, subject, topic):
@@ -507,6 +731,135 @@ def add_bookmark():
     
     return redirect(request.referrer or url_for('home'))
 
+def bookmark_entry(bookmark, question):
+    """Template dict for one bookmark and its question row"""
+    return {
+        'bookmark_id': bookmark['id'],
+        'question_id': bookmark['question_id'],
+        'subject': bookmark['subject'],
+        'topic': bookmark['topic'],
+        'source_database': bookmark['source_database'],
+        'created_at': bookmark['created_at'],
+        'question': question['question'],
+        'answer': question['answer']
+    }
+
+def enrich_bookmarks(bookmarks):
+    """Attach question/answer text to bookmark rows.
+
+    Bookmarks are grouped by source database and fetched with one
+    WHERE id IN (...) query per chunk, instead of one connection per row.
+    Bookmarks whose question no longer exists are dropped.
+    """
+    ids_by_database = {}
+    for bookmark in bookmarks:
+        ids_by_database.setdefault(bookmark['source_database'], []).append(bookmark['question_id'])
+
+    questions = {}  # (source_database, question_id) -> row
+    for source_db, question_ids in ids_by_database.items():
+        question_ids = list(dict.fromkeys(question_ids))
+        try:
+            with dynamic_db_handler.connection(source_db) as source_conn:
+                for start in range(0, len(question_ids), SQLITE_MAX_IN_PARAMS):
+                    chunk = question_ids[start:start + SQLITE_MAX_IN_PARAMS]
+                    placeholders = ','.join('?' * len(chunk))
+                    for row in source_conn.execute(
+                        f'SELECT id, question, answer FROM qbank WHERE id IN ({placeholders})',
+                        chunk
+                    ).fetchall():
+                        questions[(source_db, row['id'])] = row
+        except Exception as e:
+            print(f"Error enriching bookmarks from {source_db}: {e}")
+
+    enriched_bookmarks = []
+    for bookmark in bookmarks:
+        question = questions.get((bookmark['source_database'], bookmark['question_id']))
+        if question:
+            enriched_bookmarks.append(bookmark_entry(bookmark, question))
+    return enriched_bookmarks
+
+def get_bookmarks_page(user_conn, user_id, subject=None, sources=None):
+    """One page of bookmarks, newest first, using the ?before=&before_id= keyset cursor.
+
+    With sources ({source_database: alias} from attached_connection) the
+    question text is joined in the same statement and bookmarks whose
+    question no longer exists are skipped.
+    Returns (bookmarks, next_cursor); next_cursor is None on the last page.
+    """
+    conditions = ['b.user_id = ?']
+    params = [user_id]
+    if subject:
+        conditions.append('LOWER(b.subject) = ?')
+        params.append(subject.lower())
+
+    before = request.args.get('before')
+    before_id = request.args.get('before_id', type=int)
+    if before and before_id is not None:
+        conditions.append('(b.created_at < ? OR (b.created_at = ? AND b.id < ?))')
+        params.extend([before, before, before_id])
+    where = ' AND '.join(conditions)
+
+    if sources:
+        selects = []
+        query_params = []
+        for source_db, alias in sources.items():
+            selects.append(f'''
+                SELECT b.*, q.question, q.answer FROM user_bookmarks b
+                JOIN "{alias}".qbank q ON q.id = b.question_id
+                WHERE b.source_database = ? AND {where}
+            ''')
+            query_params += [source_db] + params
+        query = ' UNION ALL '.join(selects)
+        params = query_params
+    else:
+        query = f'SELECT b.* FROM user_bookmarks b WHERE {where}'
+
+    rows = user_conn.execute(f'''
+        {query}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    ''', params + [BOOKMARKS_PAGE_SIZE + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > BOOKMARKS_PAGE_SIZE:
+        rows = rows[:BOOKMARKS_PAGE_SIZE]
+        next_cursor = {'before': rows[-1]['created_at'], 'before_id': rows[-1]['id']}
+    return rows, next_cursor
+
+def get_bookmark_subject_counts(user_conn, user_id, subject=None):
+    """{subject: count} over all of the user's bookmarks (not just the current page)"""
+    query = 'SELECT subject, COUNT(*) AS count FROM user_bookmarks WHERE user_id = ?'
+    params = [user_id]
+    if subject:
+        query += ' AND LOWER(subject) = ?'
+        params.append(subject.lower())
+    query += ' GROUP BY subject ORDER BY MAX(created_at) DESC'
+    return {row['subject']: row['count'] for row in user_conn.execute(query, params).fetchall()}
+
+def load_bookmarks(user_id, subject=None):
+    """(bookmarks, next_cursor, subject_counts) for the bookmarks pages.
+
+    The qbank files are ATTACHed to the user database connection so the page
+    is one joined query; past SQLite's attach limit (or if attaching fails)
+    the question text is fetched per source database instead.
+    """
+    qbank_files = dynamic_db_handler.goal_registry.get_files('qbank')
+    try:
+        with dynamic_db_handler.attached_connection(USER_DB_FILE, qbank_files) as (user_conn, sources):
+            rows, next_cursor = get_bookmarks_page(user_conn, user_id, subject, sources=sources)
+            subject_counts = get_bookmark_subject_counts(user_conn, user_id, subject)
+        return [bookmark_entry(row, row) for row in rows], next_cursor, subject_counts
+    except (ValueError, sqlite3.Error) as e:
+        print(f"Attached bookmark query unavailable, enriching per database: {e}")
+
+    user_conn = get_user_db_connection()  # Always admin_users.db
+    try:
+        rows, next_cursor = get_bookmarks_page(user_conn, user_id, subject)
+        subject_counts = get_bookmark_subject_counts(user_conn, user_id, subject)
+    finally:
+        user_conn.close()
+    return enrich_bookmarks(rows), next_cursor, subject_counts
+
 @app.route('/bookmarks')
 def bookmarks():
     """Get ALL bookmarks from centralized database"""
@@ -514,44 +867,13 @@ def bookmarks():
     if not user_id:
         flash('Please login to view your bookmarks')
         return redirect(url_for('login'))
-    
-    user_conn = get_user_db_connection()  # Always admin_users.db
-    try:
-        # Get bookmarks with source database info
-        bookmarks = user_conn.execute('''
-            SELECT * FROM user_bookmarks 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC
-        ''', (user_id,)).fetchall()
-        
-        # Enrich with actual question data from source databases
-        enriched_bookmarks = []
-        for bookmark in bookmarks:
-            try:
-                source_conn = dynamic_db_handler.get_connection(bookmark['source_database'])
-                question = source_conn.execute(
-                    'SELECT question, answer FROM qbank WHERE id = ?',
-                    (bookmark['question_id'],)
-                ).fetchone()
-                
-                if question:
-                    enriched_bookmarks.append({
-                        'bookmark_id': bookmark['id'],
-                        'question_id': bookmark['question_id'],
-                        'subject': bookmark['subject'],
-                        'topic': bookmark['topic'],
-                        'source_database': bookmark['source_database'],
-                        'created_at': bookmark['created_at'],
-                        'question': question['question'],
-                        'answer': question['answer']
-                    })
-                source_conn.close()
-            except Exception as e:
-                print(f"Error enriching bookmark from {bookmark['source_database']}: {e}")
-        
-        return render_template('bookmarks.html', bookmarks=enriched_bookmarks)
-    finally:
-        user_conn.close()
+
+    bookmarks, next_cursor, subject_counts = load_bookmarks(user_id)
+    return render_template('bookmarks.html',
+                           bookmarks=bookmarks,
+                           subject_counts=subject_counts,
+                           total_bookmarks=sum(subject_counts.values()),
+                           next_cursor=next_cursor)
 
 @app.route('/bookmarks/subject/<subject_name>')
 def bookmarks_by_subject(subject_name):
@@ -560,45 +882,14 @@ def bookmarks_by_subject(subject_name):
     if not user_id:
         flash('Please login first')
         return redirect(url_for('login'))
-    
-    user_conn = get_user_db_connection()
-    try:
-        bookmarks = user_conn.execute('''
-            SELECT * FROM user_bookmarks 
-            WHERE user_id = ? AND LOWER(subject) = ?
-            ORDER BY created_at DESC
-        ''', (user_id, subject_name.lower())).fetchall()
-        
-        # Enrich bookmarks with actual question data
-        enriched_bookmarks = []
-        for bookmark in bookmarks:
-            try:
-                source_conn = dynamic_db_handler.get_connection(bookmark['source_database'])
-                question = source_conn.execute(
-                    'SELECT question, answer FROM qbank WHERE id = ?',
-                    (bookmark['question_id'],)
-                ).fetchone()
-                
-                if question:
-                    enriched_bookmarks.append({
-                        'bookmark_id': bookmark['id'],
-                        'question_id': bookmark['question_id'],
-                        'subject': bookmark['subject'],
-                        'topic': bookmark['topic'],
-                        'source_database': bookmark['source_database'],
-                        'created_at': bookmark['created_at'],
-                        'question': question['question'],
-                        'answer': question['answer']
-                    })
-                source_conn.close()
-            except Exception as e:
-                print(f"Error enriching bookmark: {e}")
-        
-        return render_template('bookmarks.html', 
-                             bookmarks=enriched_bookmarks, 
-                             filtered_subject=subject_name)
-    finally:
-        user_conn.close()
+
+    bookmarks, next_cursor, subject_counts = load_bookmarks(user_id, subject=subject_name)
+    return render_template('bookmarks.html', 
+                           bookmarks=bookmarks, 
+                           filtered_subject=subject_name,
+                           subject_counts=subject_counts,
+                           total_bookmarks=sum(subject_counts.values()),
+                           next_cursor=next_cursor)
 
 @app.route('/remove_bookmark/<int:bookmark_id>', methods=['POST'])
 def remove_bookmark_by_id(bookmark_id):
@@ -637,12 +928,25 @@ def remove_bookmark_by_id(bookmark_id):
 @app.route('/admin/setup_content_access')
 def admin_setup_content_access():
     """Admin route to setup content access - Only specific topics are free"""
-    success = setup_free_content()
-    if success:
-        return "Content access setup completed. Only specific basic topics are free, all others require login. <a href='/home'>Back to Home</a>"
-    else:
+    report = setup_free_content()
+    if not report:
         return "Failed to setup content access. <a href='/home'>Back to Home</a>"
 
+    rows = ''.join(
+        f"<tr><td>{entry['database']}</td><td>{entry['rows_changed']}</td>"
+        f"<td>{entry['elapsed_ms'] if entry['elapsed_ms'] is not None else '-'}</td>"
+        f"<td>{entry['error'] or 'OK'}</td></tr>"
+        for entry in report
+    )
+    return f"""
+    <p>Content access setup completed. Only specific basic topics are free, all others require login.</p>
+    <table border="1" cellpadding="4">
+        <tr><th>Database</th><th>Rows changed</th><th>Time (ms)</th><th>Status</th></tr>
+        {rows}
+    </table>
+    <p><a href='/home'>Back to Home</a></p>
+    """
+
 @app.route('/admin/require_login/<subject>/<topic>')
 def admin_require_login(subject, topic):
     """Admin route to mark specific topic as requiring login"""
@@ -1216,6 +1520,19 @@ def home():
                             "Orthopedics", "Dermatology", "Psychiatry", "Radiology"]
     }
 
+    # Progress for every subject shown (only for logged-in users)
+    progress = {}
+    if user_id:
+        try:
+            # Use the first database that has each subject
+            progress = get_subject_progress(user_id, {
+                subject: all_subjects[subject][0]['database']
+                for subjects in PROF_YEAR_MAP.values() for subject in subjects
+                if subject in all_subjects
+            })
+        except Exception as e:
+            print(f"Error getting subject progress: {e}")
+
     grouped_subjects = {}
 
     # Categorize subjects found in databases
@@ -1223,33 +1540,7 @@ def home():
         matched_subjects = []
         for subject in subjects:
             if subject in all_subjects:
-                # Use the first database that has this subject
-                db_info = all_subjects[subject][0]
-                
-                # Get completion status for this subject (only for logged-in users)
-                completed_topics = 0
-                total_topics = 0
-                if user_id:
-                    try:
-                        conn = dynamic_db_handler.get_connection(db_info['database'])
-                        total_topics_result = conn.execute(
-                            'SELECT COUNT(DISTINCT topic) as count FROM qbank WHERE LOWER(subject) = ?',
-                            (subject.lower(),)
-                        ).fetchone()
-                        total_topics = total_topics_result['count'] if total_topics_result else 0
-                        
-                        # Get completion from centralized database
-                        user_conn = get_user_db_connection()
-                        completed_topics_result = user_conn.execute(
-                            'SELECT COUNT(*) as count FROM user_topic_completion WHERE user_id = ? AND LOWER(subject) = ? AND source_database = ?',
-                            (user_id, subject.lower(), db_info['database'])
-                        ).fetchone()
-                        completed_topics = completed_topics_result['count'] if completed_topics_result else 0
-                        user_conn.close()
-                        conn.close()
-                    except Exception as e:
-                        print(f"Error getting completion for {subject}: {e}")
-                
+                completed_topics, total_topics = progress.get(subject, (0, 0))
                 matched_subjects.append({
                     'name': subject,
                     'completed_topics': completed_topics,
@@ -1274,87 +1565,12 @@ def home():
 
 @app.route('/subject/<subject_name>')
 def show_subject(subject_name):
-    """UPDATED: Subject page - Uses dynamic database detection"""
+    """UPDATED: Subject page - chapter/topic tree served from the content catalog"""
     user_id = session.get('user_id')
 
-    # Dynamic database selection
-    try:
-        conn = get_dynamic_subject_connection(subject_name)
-        print(f"Using dynamic database for {subject_name}")  # Debug line
-    except Exception as e:
-        print(f"Error with dynamic connection, falling back to default: {e}")
-        conn = get_dynamic_subject_connection('Anatomy')  # Fallback
-
-    # Rest of your existing code stays exactly the same!
-    chapters = conn.execute(
-        '''
-        SELECT DISTINCT chapter 
-        FROM qbank 
-        WHERE LOWER(subject) = ? AND chapter != "" 
-        ORDER BY chapter
-        ''',
-        (subject_name.lower(),)
-    ).fetchall()
-
-    # For each chapter, get the topics with question counts
-    chapters_with_topics = []
-    for row in chapters:
-        chapter = row['chapter']
-        topics = conn.execute(
-            '''
-            SELECT DISTINCT topic 
-            FROM qbank 
-            WHERE LOWER(subject) = ? AND chapter = ? AND topic != "" 
-            ORDER BY topic
-            ''',
-            (subject_name.lower(), chapter)
-        ).fetchall()
-        
-        # Enhanced topic list with question counts and access information
-        enhanced_topics = []
-        for topic_row in topics:
-            topic_name = topic_row['topic']
-            question_count = get_question_count(conn, subject_name, topic_name)
-            is_completed = is_topic_completed(conn, user_id, subject_name, topic_name)
-            
-            # Check if topic requires login (FIXED: Only show lock if user is NOT logged in)
-            topic_requires_login = is_topic_login_required(subject_name, topic_name)
-            show_lock = topic_requires_login and not user_id  # Only show lock if login required AND user not logged in
-            
-            # Generate a rating based on question count
-            if question_count >= 50:
-                rating = 4.8
-            elif question_count >= 30:
-                rating = 4.5
-            elif question_count >= 15:
-                rating = 4.2
-            elif question_count >= 5:
-                rating = 4.0
-            else:
-                rating = 3.8
-            
-            # Determine status - show login required only if user not logged in
-            if show_lock:
-                status = 'LOGIN REQUIRED'
-            else:
-                status = 'FREE'
-            
-            topic_data = {
-                'name': topic_name,
-                'question_count': question_count,
-                'rating': rating,
-                'status': status,
-                'completed': is_completed,
-                'requires_login': show_lock  # This controls the lock icon
-            }
-            enhanced_topics.append(topic_data)
-        
-        chapters_with_topics.append({
-            'chapter': chapter, 
-            'topics': enhanced_topics
-        })
+    source_db = find_subject_database(subject_name)
+    chapters_with_topics = build_subject_outline(subject_name, user_id, source_db)
 
-    conn.close()
     return render_template('subject_chapters.html',
                            subject=subject_name.title(),
                            chapters=chapters_with_topics)
@@ -1370,25 +1586,17 @@ def show_topic(subject_name, topic_name):
             flash('🔒 This topic requires login to access. Please sign up or log in to continue your medical studies.', 'info')
             return redirect(url_for('signup', restricted=True))
     
-    # Topic is accessible - proceed to show content
-    try:
-        conn = get_dynamic_subject_connection(subject_name)
-    except Exception as e:
-        print(f"Error with dynamic connection, falling back to default: {e}")
-        conn = get_dynamic_subject_connection('Anatomy')
-    
-    row = conn.execute(
-        'SELECT id FROM qbank WHERE LOWER(subject)=? AND topic=? ORDER BY id LIMIT 1',
-        (subject_name.lower(), topic_name)
-    ).fetchone()
-    conn.close()
+    # Topic is accessible - first question comes from the content catalog
+    outline = dynamic_db_handler.get_subject_outline(find_subject_database(subject_name), subject_name)
+    first_ids = [topics[topic_name]['first_question_id']
+                 for topics in outline.values() if topic_name in topics]
 
-    if row:
+    if first_ids:
         return redirect(url_for(
             'show_question',
             subject_name=subject_name,
             topic_name=topic_name,
-            qid=row['id']
+            qid=min(first_ids)
         ))
     return "<h2>No questions found for this topic</h2>"
 
@@ -1412,28 +1620,15 @@ def show_question(subject_name, topic_name, qid):
     
     user_id = session.get('user_id')
 
-    # Get all question ids for pagination
-    all_ids = conn.execute(
-        'SELECT id FROM qbank WHERE LOWER(subject)=? AND topic=? ORDER BY id',
-        (subject_name.lower(), topic_name)
-    ).fetchall()
-    id_list = [r['id'] for r in all_ids]
-
-    try:
-        index = id_list.index(qid)
-    except ValueError:
+    # Pagination and next topic come from the catalog navigation index
+    nav = dynamic_db_handler.get_question_nav(
+        find_subject_database(subject_name), subject_name, topic_name, qid)
+    if nav is None:
         conn.close()
         return "<h2>Question not found</h2>"
 
-    prev_qid = id_list[index-1] if index > 0 else None
-    next_qid = id_list[index+1] if index < len(id_list)-1 else None
-    is_last_question = index == len(id_list) - 1
-
     question = conn.execute('SELECT * FROM qbank WHERE id=?', (qid,)).fetchone()
-    bookmarked = is_bookmarked(conn, user_id, qid)
-    
-    # Get next topic for navigation
-    next_topic = get_next_topic(conn, subject_name, topic_name) if is_last_question else None
+    bookmarked = get_user_state(user_id).is_bookmarked(qid)
     
     conn.close()
 
@@ -1442,12 +1637,12 @@ def show_question(subject_name, topic_name, qid):
         subject=subject_name,
         topic=topic_name,
         q=question,
-        current_index=index + 1,
-        total=len(id_list),
-        prev_qid=prev_qid,
-        next_qid=next_qid,
-        is_last_question=is_last_question,
-        next_topic=next_topic,
+        current_index=nav['index'] + 1,
+        total=nav['total'],
+        prev_qid=nav['prev_qid'],
+        next_qid=nav['next_qid'],
+        is_last_question=nav['is_last_question'],
+        next_topic=nav['next_topic'],
         bookmarked=bookmarked
     )
 
@@ -1466,8 +1661,7 @@ def subscribe():
         flash("Name and goal are required.", "error")
         return redirect(url_for('home'))
 
-    conn = sqlite3.connect('/var/data/admin_users.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_user_db_connection()
     try:
         # Optional: update name if you want to sync it
         conn.execute(
@@ -1504,28 +1698,17 @@ def show_answer(subject_name, topic_name, qid):
     
     user_id = session.get('user_id')
     
-    all_ids = conn.execute(
-        'SELECT id FROM qbank WHERE LOWER(subject)=? AND topic=? ORDER BY id',
-        (subject_name.lower(), topic_name)
-    ).fetchall()
-    id_list = [r['id'] for r in all_ids]
-
-    try:
-        index = id_list.index(qid)
-    except ValueError:
+    nav = dynamic_db_handler.get_question_nav(
+        find_subject_database(subject_name), subject_name, topic_name, qid)
+    if nav is None:
         conn.close()
         return "<h2>Answer not found</h2>"
 
-    prev_qid = id_list[index-1] if index > 0 else None
-    next_qid = id_list[index+1] if index < len(id_list)-1 else None
-    is_last_question = index == len(id_list) - 1
-
     q = conn.execute('SELECT * FROM qbank WHERE id=?', (qid,)).fetchone()
-    bookmarked = is_bookmarked(conn, user_id, qid)
-    user_note = get_user_note(conn, user_id, qid)
-    
-    # Get next topic for navigation
-    next_topic = get_next_topic(conn, subject_name, topic_name) if is_last_question else None
+    # Bookmark and note in one round trip to admin_users.db
+    user_state = get_user_state(user_id).load(question_ids=[qid])
+    bookmarked = user_state.is_bookmarked(qid)
+    user_note = user_state.get_note(qid)
     
     conn.close()
 
@@ -1534,16 +1717,39 @@ def show_answer(subject_name, topic_name, qid):
         subject=subject_name,
         topic=topic_name,
         q=q,
-        current_index=index + 1,
-        total=len(id_list),
-        prev_qid=prev_qid,
-        next_qid=next_qid,
-        is_last_question=is_last_question,
-        next_topic=next_topic,
+        current_index=nav['index'] + 1,
+        total=nav['total'],
+        prev_qid=nav['prev_qid'],
+        next_qid=nav['next_qid'],
+        is_last_question=nav['is_last_question'],
+        next_topic=nav['next_topic'],
         bookmarked=bookmarked,
         user_note=user_note
     )
 
+def render_snippet(snippet):
+    """Escaped FTS snippet with <mark>ed matches, safe to output in templates"""
+    return Markup(highlight_snippet(snippet))
+
+@app.route('/search')
+def search():
+    """Full-text search over the current goal's question banks"""
+    query = request.args.get('q', '').strip()
+    goal_key = session.get('current_goal')
+
+    hits = []
+    elapsed_ms = None
+    if query:
+        started = time.perf_counter()
+        hits = dynamic_db_handler.search_qbank(
+            query, dynamic_db_handler.goal_registry.get_files('qbank', goal_key))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for hit in hits:
+            hit['question_snippet'] = render_snippet(hit['question_snippet'])
+            hit['answer_snippet'] = render_snippet(hit['answer_snippet'])
+
+    return render_template('search.html', query=query, hits=hits, elapsed_ms=elapsed_ms)
+
 # Add this line before if __name__ == '__main__':
 register_dynamic_db_routes(app, ensure_user_session)
 register_mcq_routes(app)
@@ -2,15 +2,136 @@
 import sqlite3
 import os
 import glob
+import bisect
+import queue
+import re
 from flask import render_template, request, redirect, url_for, flash, jsonify, session
 from datetime import datetime
 import shutil
+import threading
+import time
 import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from werkzeug.utils import secure_filename
 from fnmatch import fnmatch
+from contextlib import contextmanager
+from urllib.parse import quote
+from markupsafe import escape
 
 BASE_DATA_DIR = '/var/data'
 
+# How often (seconds) cached indexes re-stat /var/data to pick up changed files
+INDEX_CHECK_INTERVAL = 5
+
+# Connection pool settings (per database file, per worker process)
+POOL_MAX_SIZE = 8               # idle connections kept open per database
+POOL_CACHED_STATEMENTS = 256    # sqlite3 prepared-statement cache per connection
+
+# Multi-database reads (see DynamicDatabaseHandler.fan_out)
+FAN_OUT_MAX_WORKERS = 4         # sqlite3 releases the GIL while a query runs
+FAN_OUT_TIMEOUT = 10            # seconds for the whole fan-out call
+FAN_OUT_THREAD_PREFIX = 'db-fan-out'
+CATALOG_BUILD_TIMEOUT = 120     # seconds to re-aggregate changed qbank files
+
+# One database's share of a fan-out: value is the rows (fan_out) or the
+# function's return value (fan_out_map); elapsed_ms is None on timeout
+FanOutResult = namedtuple('FanOutResult', 'db_file value error elapsed_ms')
+
+# Full-text search (see DynamicDatabaseHandler.search_qbank)
+SEARCH_RESULT_LIMIT = 50
+SEARCH_MAX_TERMS = 8
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'   # match markers in snippets, turned into <mark> on render
+MCQ_FACETS = ('subject', 'chapter', 'topic', 'difficulty', 'year_of_question')
+
+
+def db_file_signature(db_file):
+    """(mtime_ns, size) of a database file and of its -wal file, for cache keys.
+
+    A WAL-mode commit only appends to the -wal file and leaves the main
+    file untouched until a checkpoint, so the main file alone is not enough.
+    Raises OSError if db_file does not exist.
+    """
+    stat = os.stat(db_file)
+    try:
+        wal = os.stat(f'{db_file}-wal')
+        wal_signature = (wal.st_mtime_ns, wal.st_size)
+    except OSError:
+        wal_signature = None
+    return (stat.st_mtime_ns, stat.st_size, wal_signature)
+
+
+def build_fts_query(text):
+    """FTS5 MATCH expression for free text: every word must match, the last one as a prefix.
+
+    Words are quoted, so operators and punctuation in user input cannot
+    produce an FTS5 syntax error. Returns None when there is nothing to search.
+    """
+    terms = re.findall(r'\w+', text or '')[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlight_snippet(snippet):
+    """HTML-escape an FTS snippet and turn its match markers into <mark> tags"""
+    if not snippet:
+        return ''
+    return str(escape(snippet)).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+
+# Cross-database joins (see DynamicDatabaseHandler.attached_connection)
+MAX_ATTACHED_DATABASES = 10     # SQLite's default SQLITE_MAX_ATTACHED
+
+# Connection profiles, applied once when a pooled connection is opened.
+# Content databases are read almost exclusively, so checkouts default to
+# mode=ro; writers (admin edits, test submissions) ask for readonly=False.
+# 'immutable' stays off because admins edit content files in place.
+CONTENT_DB_PROFILE = {
+    'read_only': True,
+    'immutable': False,
+    'pragmas': {
+        'mmap_size': 268435456,     # 256 MB
+        'cache_size': -32000,       # ~32 MB page cache
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+
+# Write-heavy databases (user bookmarks/notes/completions, test responses)
+WRITE_DB_PROFILE = {
+    'read_only': False,
+    'pragmas': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -8000,
+    },
+}
+
+# Hot qbank queries, shown with EXPLAIN QUERY PLAN on /admin/query_plans
+QBANK_HOT_QUERIES = [
+    ('Topic question ids (navigation)',
+     'SELECT id FROM qbank WHERE LOWER(subject)=? AND topic=? ORDER BY id',
+     ('anatomy', 'Bones')),
+    ('Subject chapters/topics',
+     'SELECT DISTINCT chapter, topic FROM qbank WHERE LOWER(subject) = ? ORDER BY chapter, topic',
+     ('anatomy',)),
+    ('Topic premium flag',
+     'SELECT is_premium FROM qbank WHERE LOWER(subject) = ? AND LOWER(topic) = ? LIMIT 1',
+     ('anatomy', 'bones')),
+    ('Topic question count',
+     'SELECT COUNT(*) FROM qbank WHERE LOWER(subject) = ? AND topic = ?',
+     ('anatomy', 'Bones')),
+]
+
+DEFAULT_DB_PROFILE = {
+    'read_only': False,
+    'pragmas': {},
+}
+
 GOALS = {
     'neet_ug': {
         'label': 'NEET UG',
@@ -23,6 +144,218 @@ GOALS = {
     # add more goals if you need
 }
 
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool instead of closing it"""
+
+    def close(self):
+        pool = getattr(self, '_pool', None)
+        if pool is None:
+            super().close()
+        elif getattr(self, '_checked_out', False):
+            pool.release(self)
+
+    def close_physical(self):
+        super().close()
+
+    def __del__(self):
+        # Caller dropped the connection without close(): free its pool slot
+        pool = getattr(self, '_pool', None)
+        if pool is not None and getattr(self, '_checked_out', False):
+            pool.forget(self)
+
+
+class ConnectionPool:
+    """Pool of long-lived connections to one database file.
+
+    A connection is checked out by one thread (or greenlet, under a patched
+    gunicorn worker) at a time and returned on close(). Up to max_size idle
+    connections are kept; a checkout never blocks - when none are idle a new
+    connection is opened and the surplus is closed again on release.
+    """
+
+    def __init__(self, db_file, profile=DEFAULT_DB_PROFILE, read_only=False, max_size=POOL_MAX_SIZE):
+        self.db_file = db_file
+        self.profile = profile
+        self.read_only = read_only
+        self.max_size = max_size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+        # Metrics
+        self.checkouts = 0
+        self.hits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _open(self):
+        if self.read_only:
+            params = 'mode=ro&immutable=1' if self.profile.get('immutable') else 'mode=ro'
+        else:
+            params = 'mode=rw'
+        conn = sqlite3.connect(
+            f"file:{quote(self.db_file)}?{params}",
+            uri=True,
+            factory=PooledConnection,
+            check_same_thread=False,
+            cached_statements=POOL_CACHED_STATEMENTS
+        )
+        # Enable foreign keys
+        conn.execute("PRAGMA foreign_keys = ON")
+        for pragma, value in self.profile.get('pragmas', {}).items():
+            if pragma == 'journal_mode' and self.read_only:
+                continue  # read-only connections cannot switch the journal
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def checkout(self):
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+            hit = True
+        except queue.Empty:
+            conn = self._open()
+            hit = False
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self.checkouts += 1
+            self.hits += 1 if hit else 0
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+
+        conn.row_factory = sqlite3.Row
+        conn._pool = self
+        conn._checked_out = True
+        return conn
+
+    def release(self, conn):
+        conn._checked_out = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        if self._closed or self._idle.qsize() >= self.max_size:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def _discard(self, conn):
+        self.forget(conn)
+        conn.close_physical()
+
+    def forget(self, conn):
+        conn._pool = None
+        with self._lock:
+            self._created -= 1
+
+    def close_all(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            idle = self._idle.qsize()
+            return {
+                'database': self.db_file,
+                'mode': 'ro' if self.read_only else 'rw',
+                'size': self._created,
+                'idle': idle,
+                'in_use': self._created - idle,
+                'max_idle': self.max_size,
+                'checkouts': self.checkouts,
+                'hits': self.hits,
+                'hit_rate': round(self.hits / self.checkouts, 3) if self.checkouts else 0.0,
+                'avg_wait_ms': round(self.wait_time / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+            }
+
+
+class GoalRegistry:
+    """Goal key -> qbank/mcq/test database files, kept in memory.
+
+    Refreshed by a debounced poll: at most once every INDEX_CHECK_INTERVAL
+    seconds the data directory's mtime is checked (it changes when a file
+    is created, deleted or renamed) and only then is it re-globbed.
+    """
+
+    CATEGORIES = ('qbank', 'mcq', 'test')
+
+    def __init__(self, handler, interval=INDEX_CHECK_INTERVAL):
+        self.handler = handler
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._databases = {}        # (goal_key or None, category) -> [db_info]
+        self._dir_mtime = None
+        self._last_check = 0
+        self._stale = True
+
+    def matches_goal(self, category, goal_key, db_file):
+        """qbank files belong to a goal by "<goal_key>_" prefix, tests/MCQs by substring"""
+        if category == 'qbank':
+            return os.path.basename(db_file).startswith(f"{goal_key}_")
+        return goal_key.lower() in db_file.lower()
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and not self._stale and now - self._last_check < self.interval:
+            return
+
+        with self._lock:
+            self._last_check = now
+            try:
+                dir_mtime = os.stat(BASE_DATA_DIR).st_mtime_ns
+            except OSError:
+                dir_mtime = None
+            if not force and not self._stale and dir_mtime == self._dir_mtime:
+                return
+
+            discovered = self.handler.discover_databases()
+            self.handler.discovered_databases = discovered
+
+            databases = {}
+            for category in self.CATEGORIES:
+                category_dbs = discovered.get(category, [])
+                databases[(None, category)] = category_dbs
+                for goal_key in GOALS:
+                    databases[(goal_key, category)] = [
+                        db_info for db_info in category_dbs
+                        if self.matches_goal(category, goal_key, db_info['file'])
+                    ]
+
+            self._databases = databases
+            self._dir_mtime = dir_mtime
+            self._stale = False
+
+        # Every category is migrated and indexed before its first use, not
+        # only when the qbank catalog refreshes (a no-op for checked files)
+        self.handler.ensure_discovered_indexes()
+
+    def invalidate(self):
+        """Re-scan on the next lookup (after admin add/upload/delete)"""
+        self._stale = True
+
+    def get_databases(self, category, goal_key=None):
+        """db_info dicts for a category, limited to goal_key's files when given"""
+        self.refresh()
+        return self._databases.get((goal_key or None, category), [])
+
+    def get_files(self, category, goal_key=None):
+        return [db_info['file'] for db_info in self.get_databases(category, goal_key)]
+
+
 class DynamicDatabaseHandler:
     def __init__(self):
         self.db_categories = {
@@ -30,36 +363,84 @@ class DynamicDatabaseHandler:
                 'pattern': '*year*.db',
                 'description': 'Question Bank Databases',
                 'required_tables': ['qbank'],
-                'schema': self.get_qbank_schema()
+                'schema': self.get_qbank_schema(),
+                'indexes': self.get_qbank_indexes(),
+                'search_index': self.get_qbank_search_index(),
+                'connection_profile': CONTENT_DB_PROFILE
             },
             'users': {
                 'pattern': 'admin_users.db',
                 'description': 'Centralized User Database',
                 'required_tables': ['users'],
-                'schema': self.get_centralized_user_schema()
+                'schema': self.get_centralized_user_schema(),
+                'connection_profile': WRITE_DB_PROFILE
             },
             'mcq': {
                 'pattern': '*mcq*.db',
                 'description': 'MCQ Databases',
                 'required_tables': ['mcq_questions'],
-                'schema': self.get_mcq_schema()
+                'schema': self.get_mcq_schema(),
+                'migrations': self.get_mcq_migrations(),
+                'search_index': self.get_mcq_search_index(),
+                'connection_profile': CONTENT_DB_PROFILE
             },
             'admin': {
                 'pattern': 'admin*.db',
                 'description': 'Admin & System Data',
                 'required_tables': ['admin_actions'],
-                'schema': self.get_admin_schema()
+                'schema': self.get_admin_schema(),
+                'connection_profile': WRITE_DB_PROFILE
             },
             # ------ Add this block ------
             'test': {
                 'pattern': '*test.db',
                 'description': 'Test Databases',
                 'required_tables': ['test_info', 'test_questions'],
-                'schema': self.get_test_schema()
+                'schema': self.get_test_schema(),
+                'migrations': self.get_test_migrations(),
+                # Questions are read-only content; submissions write user_responses
+                'connection_profile': {
+                    **CONTENT_DB_PROFILE,
+                    'pragmas': {**CONTENT_DB_PROFILE['pragmas'], **WRITE_DB_PROFILE['pragmas']},
+                }
             }
             # ------ End addition ------
         }
 
+        # One connection pool per database file (see get_connection)
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+        # Bumped by close_pool() so pooled connections re-ATTACH replaced files
+        self._attach_epoch = 0
+
+        # Bounded thread pool for fan_out(), created on first use
+        self._fan_out_executor = None
+        self._fan_out_lock = threading.Lock()
+
+        # Files whose category migrations and indexes have been checked (see ensure_indexes)
+        self._indexed_files = set()
+        self._ensure_lock = threading.Lock()
+
+        # qbank content catalog and the subject/goal -> database routing
+        # index derived from it (see refresh_catalog)
+        self._index_lock = threading.RLock()
+        self._catalog = {}
+        self._subject_index = {}
+        self._goal_subject_index = {}
+        self._catalog_checked = False
+        self._last_index_check = 0
+
+        # Auto-discover databases on startup
+        self.discovered_databases = self.discover_databases()
+
+        # Goal -> qbank/mcq/test files for request handlers (see GoalRegistry)
+        self.goal_registry = GoalRegistry(self)
+
+        # test_id -> [test database files] (see locate_test)
+        self._test_locator = {}
+        self._test_files = {}
+
     def get_test_schema(self):
         """Schema for test-type databases with subjects, topics, MCQs, and timing info"""
         return {
@@ -104,8 +485,15 @@ class DynamicDatabaseHandler:
                     FOREIGN KEY (test_id) REFERENCES test_info (id),
                     FOREIGN KEY (question_id) REFERENCES test_questions (id)
                 );
-           '''
-
+           ''',
+            'test_completion': '''
+                CREATE TABLE IF NOT EXISTS test_completion (
+                    user_id INTEGER NOT NULL,
+                    test_id INTEGER NOT NULL,
+                    submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, test_id)
+                ) WITHOUT ROWID
+            '''
         }
 
     def get_qbank_schema(self):
@@ -167,9 +555,6 @@ class DynamicDatabaseHandler:
             '''
         }
 
-        # Auto-discover databases on startup
-        self.discovered_databases = self.discover_databases()
-
     # Add the schema getter just below
     
     def discover_databases(self):
@@ -193,17 +578,703 @@ class DynamicDatabaseHandler:
                     discovered[category].append(db_info)
         
         return discovered
+
+    def refresh_catalog(self, force=False):
+        """Bring the qbank content catalog up to date with the files on disk.
+
+        The /var/data stat check runs at most once every INDEX_CHECK_INTERVAL
+        seconds, so request handlers normally read memory only. Only files
+        whose mtime/size changed are re-aggregated.
+        """
+        with self._index_lock:
+            now = time.monotonic()
+            if (not force and self._catalog_checked
+                    and now - self._last_index_check < INDEX_CHECK_INTERVAL):
+                return
+            self._last_index_check = now
+            self._catalog_checked = True
+
+        # The rest runs without _index_lock: holding it while waiting on the
+        # fan-out pool deadlocks against pool tasks that need the lock
+        self.discovered_databases = self.discover_databases()
+        if self.ensure_discovered_indexes():
+            # Creating indexes changed file mtimes/sizes
+            self.discovered_databases = self.discover_databases()
+        qbank_databases = self.discovered_databases.get('qbank', [])
+
+        previous = self._catalog
+        catalog = {}
+        stale = {}
+        for db_info in qbank_databases:
+            db_file = db_info['file']
+            signature = (db_info['modified'], db_info['size'])
+            entry = previous.get(db_file)
+            if entry is None or entry['signature'] != signature:
+                stale[db_file] = signature
+            else:
+                catalog[db_file] = entry
+
+        # Changed files are re-aggregated in parallel
+        for result in self.fan_out_map(
+                stale, lambda db_file: self._build_catalog_entry(db_file, stale[db_file]),
+                timeout=CATALOG_BUILD_TIMEOUT):
+            if result.value is not None:
+                catalog[result.db_file] = result.value
+            elif result.elapsed_ms is None and result.db_file in previous:
+                # Timed out: serve the old entry and retry on the next check
+                catalog[result.db_file] = previous[result.db_file]
+                self._catalog_checked = False
+
+        with self._index_lock:
+            current = self._catalog
+            for db_file in list(catalog):
+                entry = current.get(db_file)
+                if entry is not None and entry is not previous.get(db_file):
+                    # Written through meanwhile (set_topic_premium, refresh_catalog_file)
+                    catalog[db_file] = entry
+            self._catalog = catalog
+            self._rebuild_subject_index()
+
+    def refresh_catalog_file(self, db_file):
+        """Re-aggregate one qbank database right away (after admin edits to qbank)"""
+        db_file = os.path.join(BASE_DATA_DIR, os.path.basename(db_file))
+        with self._index_lock:
+            if not os.path.exists(db_file):
+                self.invalidate_catalog()
+                return
+            stat = os.stat(db_file)
+            signature = (datetime.fromtimestamp(stat.st_mtime), stat.st_size)
+            entry = self._build_catalog_entry(db_file, signature)
+            if entry is None:
+                return
+            catalog = dict(self._catalog)
+            catalog[db_file] = entry
+            self._catalog = catalog
+            self._rebuild_subject_index()
+
+    def invalidate_catalog(self):
+        """Force the next lookup to re-check every qbank file (and the goal registry)"""
+        with self._index_lock:
+            self._catalog_checked = False
+        self.goal_registry.invalidate()
+
+    def _build_catalog_entry(self, db_file, signature):
+        """Aggregate one qbank database: subject -> chapter -> topic -> counts"""
+        catalog_sql = '''
+            SELECT subject, chapter, topic,
+                   COUNT(*) AS question_count,
+                   MIN(id) AS first_question_id,
+                   {premium} AS is_premium
+            FROM qbank
+            GROUP BY subject, chapter, topic
+            ORDER BY chapter, topic
+        '''
+        try:
+            conn = self.get_connection(db_file)
+            try:
+                has_premium_column = True
+                try:
+                    rows = conn.execute(catalog_sql.format(premium='MAX(is_premium)')).fetchall()
+                except sqlite3.OperationalError:
+                    # qbank files without an is_premium column: everything requires login
+                    has_premium_column = False
+                    rows = conn.execute(catalog_sql.format(premium='1')).fetchall()
+                id_rows = conn.execute('SELECT id, subject, topic FROM qbank ORDER BY id').fetchall()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Error building catalog for {db_file}: {e}")
+            return None
+
+        subjects = {}   # exact subject text -> question count (GROUP BY subject)
+        outline = {}    # LOWER(subject) -> chapter -> topic -> info
+        for row in rows:
+            subject = row['subject']
+            subjects[subject] = subjects.get(subject, 0) + row['question_count']
+            if subject is None:
+                continue
+
+            topics = outline.setdefault(subject.lower(), {}).setdefault(row['chapter'], {})
+            info = topics.get(row['topic'])
+            if info is None:
+                topics[row['topic']] = {
+                    'question_count': row['question_count'],
+                    'first_question_id': row['first_question_id'],
+                    'is_premium': row['is_premium'] or 0,
+                }
+            else:
+                # Same subject spelled with different case
+                info['question_count'] += row['question_count']
+                info['first_question_id'] = min(info['first_question_id'], row['first_question_id'])
+                info['is_premium'] = max(info['is_premium'], row['is_premium'] or 0)
+
+        # Navigation: ordered ids per (LOWER(subject), topic) ...
+        topic_ids = {}
+        for row in id_rows:
+            if row['subject'] is None:
+                continue
+            topic_ids.setdefault((row['subject'].lower(), row['topic']), []).append(row['id'])
+
+        # ... and the subject's topic sequence (chapter, then topic) for "next topic".
+        # A topic filed under several chapters is placed under the first of them.
+        topic_order = {}
+        for subject, chapters in outline.items():
+            ordered = []
+            seen = set()
+            for topics in chapters.values():    # already in (chapter, topic) order
+                for topic in topics:
+                    if topic and topic != 'None' and topic not in seen:
+                        seen.add(topic)
+                        ordered.append(topic)
+            topic_order[subject] = {
+                'topics': ordered,
+                'position': {topic: i for i, topic in enumerate(ordered)},
+            }
+
+        return {
+            'file': db_file,
+            'signature': signature,
+            'subjects': subjects,
+            'outline': outline,
+            'topic_totals': {subject: len({topic for topics in chapters.values()
+                                           for topic in topics if topic is not None})
+                             for subject, chapters in outline.items()},
+            'access': self._build_access_map(outline),
+            # Unknown topics are free, unless the file has no is_premium column
+            'access_default': 0 if has_premium_column else 1,
+            'topic_ids': topic_ids,
+            'topic_order': topic_order,
+        }
+
+    def _build_access_map(self, outline):
+        """(LOWER(subject), LOWER(topic)) -> is_premium; premium if any chapter's copy is"""
+        access = {}
+        for subject, chapters in outline.items():
+            for topics in chapters.values():
+                for topic, info in topics.items():
+                    if topic is None:
+                        continue
+                    key = (subject, topic.lower())
+                    access[key] = max(access.get(key, 0), info['is_premium'])
+        return access
+
+    def _rebuild_subject_index(self):
+        subject_index = {}
+        goal_subject_index = {}
+        for db_info in self.discovered_databases.get('qbank', []):
+            db_file = db_info['file']
+            entry = self._catalog.get(db_file)
+            if entry is None:
+                continue
+            goal_key = self.get_goal_for_file(db_file)
+            for subject in entry['outline']:
+                # First database wins, same as the old linear scan
+                subject_index.setdefault(subject, db_file)
+                if goal_key:
+                    goal_subject_index.setdefault((goal_key, subject), db_file)
+
+        self._subject_index = subject_index
+        self._goal_subject_index = goal_subject_index
+
+    def lookup_subject_database(self, subject_name, goal_key=None):
+        """O(1) subject -> database lookup; returns None if no qbank has the subject"""
+        self.refresh_catalog()
+        subject = (subject_name or '').lower()
+        if goal_key:
+            db_file = self._goal_subject_index.get((goal_key, subject))
+            if db_file:
+                return db_file
+        return self._subject_index.get(subject)
+
+    def get_subject_outline(self, db_file, subject_name):
+        """Catalog chapter -> topic -> {question_count, first_question_id, is_premium}"""
+        self.refresh_catalog()
+        entry = self._catalog.get(db_file)
+        if entry is None:
+            return {}
+        return entry['outline'].get((subject_name or '').lower(), {})
+
+    def get_topic_total(self, db_file, subject_name):
+        """Number of distinct topics of a subject in a qbank database, from the catalog"""
+        self.refresh_catalog()
+        entry = self._catalog.get(db_file)
+        if entry is None:
+            return 0
+        return entry['topic_totals'].get((subject_name or '').lower(), 0)
+
+    def get_topic_premium(self, db_file, subject, topic):
+        """is_premium for a topic from the in-memory access map (None if db_file is unknown)"""
+        self.refresh_catalog()
+        entry = self._catalog.get(db_file)
+        if entry is None:
+            return None
+        return entry['access'].get(((subject or '').lower(), (topic or '').lower()),
+                                   entry['access_default'])
+
+    def set_topic_premium(self, db_file, is_premium, subject=None, topic=None):
+        """Write-through update of catalog premium flags after an is_premium UPDATE.
+
+        subject/topic of None mean "all". The entry is re-stamped with the
+        file's new signature so this worker does not re-aggregate it; other
+        workers see the mtime change and rebuild from the database.
+        """
+        db_file = os.path.join(BASE_DATA_DIR, os.path.basename(db_file))
+        with self._index_lock:
+            entry = self._catalog.get(db_file)
+            if entry is None:
+                return
+            subject_key = subject.lower() if subject else None
+            topic_key = topic.lower() if topic else None
+            for subject_name, chapters in entry['outline'].items():
+                if subject_key and subject_name != subject_key:
+                    continue
+                for topics in chapters.values():
+                    for topic_name, info in topics.items():
+                        if topic_key and (topic_name or '').lower() != topic_key:
+                            continue
+                        info['is_premium'] = is_premium
+
+            stat = os.stat(db_file)
+            catalog = dict(self._catalog)
+            catalog[db_file] = dict(entry,
+                                    access=self._build_access_map(entry['outline']),
+                                    signature=(datetime.fromtimestamp(stat.st_mtime), stat.st_size))
+            self._catalog = catalog
+
+    def get_question_nav(self, db_file, subject_name, topic_name, qid):
+        """Prev/next ids, position and next topic for a question, from the catalog.
+
+        Returns None when qid is not part of the topic.
+        """
+        self.refresh_catalog()
+        entry = self._catalog.get(db_file)
+        if entry is None:
+            return None
+        subject = (subject_name or '').lower()
+        id_list = entry['topic_ids'].get((subject, topic_name), [])
+
+        index = bisect.bisect_left(id_list, qid)
+        if index == len(id_list) or id_list[index] != qid:
+            return None
+
+        is_last_question = index == len(id_list) - 1
+        next_topic = None
+        if is_last_question:
+            order = entry['topic_order'].get(subject)
+            position = order['position'].get(topic_name) if order else None
+            if position is not None and position < len(order['topics']) - 1:
+                next_topic = order['topics'][position + 1]
+
+        return {
+            'index': index,
+            'total': len(id_list),
+            'prev_qid': id_list[index - 1] if index > 0 else None,
+            'next_qid': id_list[index + 1] if not is_last_question else None,
+            'is_last_question': is_last_question,
+            'next_topic': next_topic,
+        }
+
+    def search_qbank(self, query, db_files, limit=SEARCH_RESULT_LIMIT):
+        """BM25-ranked question/answer matches from several qbank databases, best first.
+
+        The databases are searched in parallel (fan_out) and merged by score.
+        Each hit has database, id, subject, chapter, topic, score and
+        question/answer snippets whose matches are wrapped in SNIPPET_START/END.
+        """
+        match = build_fts_query(query)
+        if not match:
+            return []
+
+        sql = f'''
+            SELECT q.id, q.subject, q.chapter, q.topic,
+                   snippet(qbank_fts, 0, '{SNIPPET_START}', '{SNIPPET_END}', '…', 24) AS question_snippet,
+                   snippet(qbank_fts, 1, '{SNIPPET_START}', '{SNIPPET_END}', '…', 24) AS answer_snippet,
+                   bm25(qbank_fts) AS score
+            FROM qbank_fts
+            JOIN qbank q ON q.id = qbank_fts.rowid
+            WHERE qbank_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+        '''
+        hits = []
+        for result in self.fan_out(db_files, sql, (match, limit)):
+            if result.error:
+                print(f"Error searching {result.db_file}: {result.error}")
+                continue
+            for row in result.value:
+                hit = dict(row)
+                hit['database'] = result.db_file
+                hits.append(hit)
+
+        hits.sort(key=lambda hit: hit['score'])   # bm25(): lower is a better match
+        return hits[:limit]
+
+    def search_mcq(self, query, db_files, filters=None, page=1, per_page=20):
+        """One page of MCQ hits plus facet counts across MCQ databases.
+
+        filters maps MCQ_FACETS names to a value. Text matches are ranked by
+        bm25(); without a query questions come in id order. With neither a
+        query nor filters the facet counts are read from mcq_facet_counts,
+        otherwise they are counted over the matching questions.
+        """
+        filters = {facet: str(value) for facet, value in (filters or {}).items()
+                   if facet in MCQ_FACETS and value not in (None, '')}
+        match = build_fts_query(query)
+
+        conditions, params = [], []
+        if match:
+            source = 'mcq_fts JOIN mcq_questions m ON m.id = mcq_fts.rowid'
+            snippet = f"snippet(mcq_fts, 0, '{SNIPPET_START}', '{SNIPPET_END}', '…', 24)"
+            score = 'bm25(mcq_fts)'
+            conditions.append('mcq_fts MATCH ?')
+            params.append(match)
+        else:
+            source, snippet, score = 'mcq_questions m', 'm.question', '0'
+        for facet, value in filters.items():
+            conditions.append(f"COALESCE(CAST(m.{facet} AS TEXT), '') = ?")
+            params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        hits_sql = f'''
+            SELECT m.id, m.subject, m.chapter, m.topic, m.difficulty, m.year_of_question,
+                   {snippet} AS snippet, m.option_a, m.option_b, m.option_c, m.option_d,
+                   {score} AS score
+            FROM {source} {where}
+            ORDER BY score, m.id
+            LIMIT ?
+        '''
+        if conditions:
+            facets_sql = f'''
+                WITH matched AS (SELECT m.* FROM {source} {where})
+                {' UNION ALL '.join(
+                    f"SELECT '{facet}' AS facet, COALESCE(CAST({facet} AS TEXT), '') AS value, "
+                    f"COUNT(*) AS count FROM matched GROUP BY 2"
+                    for facet in MCQ_FACETS)}
+            '''
+        else:
+            facets_sql = 'SELECT facet, value, count FROM mcq_facet_counts'
+
+        # Files discovered since startup get mcq_fts/mcq_facet_counts before the first search
+        for db_file in db_files:
+            self.ensure_indexes(db_file, 'mcq')
+
+        def run(db_file):
+            with self.connection(db_file) as conn:
+                hits = conn.execute(hits_sql, params + [page * per_page]).fetchall()
+                facets = conn.execute(facets_sql, params).fetchall()
+            return hits, facets
+
+        hits, facet_counts = [], {facet: {} for facet in MCQ_FACETS}
+        for result in self.fan_out_map(db_files, run):
+            if result.error:
+                print(f"Error searching {result.db_file}: {result.error}")
+                continue
+            db_hits, db_facets = result.value
+            for row in db_hits:
+                hit = dict(row)
+                hit['database'] = os.path.basename(result.db_file)
+                hit['snippet'] = highlight_snippet(hit['snippet'])
+                hits.append(hit)
+            for row in db_facets:
+                counts = facet_counts[row['facet']]
+                counts[row['value']] = counts.get(row['value'], 0) + row['count']
+
+        hits.sort(key=lambda hit: (hit['score'], hit['database'], hit['id']))
+        start = (page - 1) * per_page
+        return {
+            'query': query,
+            'filters': filters,
+            'page': page,
+            'per_page': per_page,
+            # every question has exactly one subject value
+            'total': sum(facet_counts['subject'].values()),
+            'hits': hits[start:start + per_page],
+            'facets': {
+                facet: [{'value': value, 'count': count}
+                        for value, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+                for facet, counts in facet_counts.items()
+            },
+        }
+
+    def get_qbank_subjects(self, goal_key=None):
+        """{subject: [{'database', 'question_count'}]} from the catalog, optionally per goal"""
+        self.refresh_catalog()
+        all_subjects = {}
+        for db_file in self.goal_registry.get_files('qbank', goal_key):
+            entry = self._catalog.get(db_file)
+            if entry is None:
+                continue
+            for subject in sorted(entry['subjects'], key=lambda s: (s is not None, s or '')):
+                all_subjects.setdefault(subject, []).append({
+                    'database': db_file,
+                    'question_count': entry['subjects'][subject]
+                })
+        return all_subjects
+
+    def refresh_test_locator(self):
+        """Re-read test ids from test databases whose file signature (incl. -wal) changed"""
+        # Queried without _index_lock (see refresh_catalog); only the swap is locked
+        test_files = {}
+        stale = {}
+        for db_info in self.goal_registry.get_databases('test'):
+            db_file = db_info['file']
+            try:
+                signature = db_file_signature(db_file)
+            except OSError:
+                continue
+            cached = self._test_files.get(db_file)
+            if cached is None or cached[0] != signature:
+                stale[db_file] = signature
+            test_files[db_file] = cached
+
+        for result in self.fan_out(stale, 'SELECT id FROM test_info'):
+            if result.error:
+                print(f"Error indexing tests in {result.db_file}: {result.error}")
+            if result.elapsed_ms is None:
+                # Timed out: leave it uncached so the next miss retries
+                del test_files[result.db_file]
+                continue
+            ids = {row['id'] for row in result.value or ()}
+            test_files[result.db_file] = (stale[result.db_file], ids)
+
+        locator = {}
+        for db_file, (signature, ids) in test_files.items():
+            for test_id in ids:
+                locator.setdefault(test_id, []).append(db_file)
+
+        with self._index_lock:
+            self._test_files = test_files
+            self._test_locator = locator
+
+    def locate_test(self, test_id, db_file=None):
+        """Database file holding test_id (or None).
+
+        With db_file, only confirms that this file has the test. Without it,
+        the first test database (in discovery order) with that id wins.
+        A miss re-checks test files that changed since the last lookup.
+        The locator lives in memory per process; it is rebuilt from the
+        test databases on first use rather than persisted.
+        """
+        if db_file:
+            db_file = os.path.join(BASE_DATA_DIR, os.path.basename(db_file))
+
+        for attempt in range(2):
+            if attempt or not self._test_files:
+                self.refresh_test_locator()
+            files = self._test_locator.get(test_id, [])
+            if db_file is None and files:
+                return files[0]
+            if db_file in files:
+                return db_file
+        return None
+
+    def register_test(self, db_file, test_id):
+        """Add a newly created test to the locator (admin add_record on test_info)"""
+        db_file = os.path.join(BASE_DATA_DIR, os.path.basename(db_file))
+        with self._index_lock:
+            files = self._test_locator.setdefault(test_id, [])
+            if db_file not in files:
+                files.append(db_file)
+
+    def get_goal_for_file(self, db_file):
+        """Return the goal key a database belongs to (by "<goal_key>_" filename prefix)"""
+        filename = os.path.basename(db_file)
+        for goal_key in GOALS:
+            if filename.startswith(f"{goal_key}_"):
+                return goal_key
+        return None
     
-    def get_connection(self, db_file):
-        """Get connection to any database file with proper error handling"""
-        if not os.path.exists(db_file):
+    def get_category_for_file(self, db_file):
+        """Return the db_categories key whose pattern matches a database file"""
+        filename = os.path.basename(db_file)
+        for category, config in self.db_categories.items():
+            if fnmatch(filename, config['pattern']):
+                return category
+        return None
+
+    def get_connection_profile(self, db_file):
+        category = self.get_category_for_file(db_file)
+        if category is None:
+            return DEFAULT_DB_PROFILE
+        return self.db_categories[category].get('connection_profile', DEFAULT_DB_PROFILE)
+
+    def get_pool(self, db_file, readonly=None):
+        """Return the connection pool for a database file, creating it on first use.
+
+        readonly=None uses the category profile default (mode=ro for content DBs).
+        """
+        path = os.path.abspath(db_file)
+        profile = self.get_connection_profile(path)
+        if readonly is None:
+            readonly = profile.get('read_only', False)
+        key = (path, readonly)
+        pool = self._pools.get(key)
+        if pool is not None:
+            return pool
+
+        if not os.path.exists(path):
             raise FileNotFoundError(f"Database file {db_file} not found")
-        
-        conn = sqlite3.connect(db_file)
-        conn.row_factory = sqlite3.Row
-        # Enable foreign keys
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(path, profile=profile, read_only=readonly)
+                self._pools[key] = pool
+        return pool
+
+    def get_connection(self, db_file, readonly=None):
+        """Check out a pooled connection to any database file.
+
+        Callers keep using conn.close(); for pooled connections that returns
+        the connection to the pool (rolling back anything left uncommitted).
+        Pass readonly=False to write to a content (qbank/mcq/test) database.
+        """
+        return self.get_pool(db_file, readonly).checkout()
+
+    @contextmanager
+    def connection(self, db_file, readonly=None):
+        """Context manager: commit on success, roll back on error, always release"""
+        conn = self.get_connection(db_file, readonly)
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def close_pool(self, db_file):
+        """Close every pooled connection for a database (before delete/replace)"""
+        path = os.path.abspath(db_file)
+        with self._pools_lock:
+            pools = [self._pools.pop(key) for key in list(self._pools) if key[0] == path]
+        for pool in pools:
+            pool.close_all()
+        # A replaced file gets its indexes checked again
+        self._indexed_files.discard(path)
+        self._attach_epoch += 1
+
+    def get_pool_stats(self):
+        """Pool size, hit rate and wait time for every database with a pool"""
+        return [pool.stats() for pool in list(self._pools.values())]
+
+    def _get_fan_out_executor(self):
+        with self._fan_out_lock:
+            if self._fan_out_executor is None:
+                self._fan_out_executor = ThreadPoolExecutor(
+                    max_workers=FAN_OUT_MAX_WORKERS, thread_name_prefix=FAN_OUT_THREAD_PREFIX
+                )
+            return self._fan_out_executor
+
+    def fan_out_map(self, db_files, func, timeout=FAN_OUT_TIMEOUT, on_timeout=None):
+        """Call func(db_file) for every database on the shared, bounded thread pool.
+
+        Returns one FanOutResult per file, in input order. An exception or a
+        timeout (seconds from the start of the call; None waits forever) only
+        turns that database's entry into an error. on_timeout(db_file) is
+        called for databases still running when the deadline passes.
+        func must not take _index_lock (catalog write-through such as
+        set_topic_premium): apply those on the calling thread afterwards.
+        """
+        db_files = list(db_files)
+
+        def timed(db_file):
+            started = time.perf_counter()
+            try:
+                value, error = func(db_file), None
+            except Exception as e:
+                value, error = None, str(e)
+            return FanOutResult(db_file, value, error, (time.perf_counter() - started) * 1000)
+
+        # A single file, or a call made from a fan-out worker (which would
+        # wait on its own bounded pool), runs inline
+        if len(db_files) <= 1 or threading.current_thread().name.startswith(FAN_OUT_THREAD_PREFIX):
+            return [timed(db_file) for db_file in db_files]
+
+        executor = self._get_fan_out_executor()
+        futures = [(db_file, executor.submit(timed, db_file)) for db_file in db_files]
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        results = []
+        for db_file, future in futures:
+            try:
+                remaining = max(0, deadline - time.monotonic()) if deadline is not None else None
+                results.append(future.result(timeout=remaining))
+            except FutureTimeoutError:
+                if not future.cancel() and on_timeout:
+                    on_timeout(db_file)
+                results.append(FanOutResult(db_file, None, f'timed out after {timeout}s', None))
+        return results
+
+    def fan_out(self, db_files, sql, params=(), timeout=FAN_OUT_TIMEOUT):
+        """Run one read-only statement against every database in parallel.
+
+        FanOutResult.value holds the fetched rows. A statement still running
+        at the deadline is interrupted so its pooled connection comes back.
+        """
+        running = {}
+
+        def run(db_file):
+            with self.connection(db_file) as conn:
+                running[db_file] = conn
+                try:
+                    return conn.execute(sql, params).fetchall()
+                finally:
+                    running.pop(db_file, None)
+
+        def interrupt(db_file):
+            conn = running.get(db_file)
+            if conn is not None:
+                conn.interrupt()
+
+        return self.fan_out_map(db_files, run, timeout, on_timeout=interrupt)
+
+    def attach_alias(self, db_file):
+        """Stable schema name for an attached database: <category>_<file stem>, e.g. qbank_3rd_year"""
+        stem = os.path.splitext(os.path.basename(db_file))[0]
+        category = self.get_category_for_file(db_file) or 'db'
+        return re.sub(r'\W', '_', f"{category}_{stem}").lower()
+
+    def _attach(self, conn, db_files):
+        attached = getattr(conn, '_attached', None) or {}   # path -> alias
+        if getattr(conn, '_attach_epoch', None) != self._attach_epoch:
+            # A database was replaced or deleted since these were attached
+            for alias in attached.values():
+                conn.execute(f'DETACH DATABASE "{alias}"')
+            attached = {}
+
+        if len(set(attached) | set(db_files)) > MAX_ATTACHED_DATABASES:
+            for path in [path for path in attached if path not in db_files]:
+                conn.execute(f'DETACH DATABASE "{attached.pop(path)}"')
+
+        for path in db_files:
+            if path not in attached:
+                alias = self.attach_alias(path)
+                conn.execute(f'ATTACH DATABASE ? AS "{alias}"', (f"file:{quote(path)}?mode=ro",))
+                attached[path] = alias
+
+        conn._attached = attached
+        conn._attach_epoch = self._attach_epoch
+        return {path: attached[path] for path in db_files}
+
+    @contextmanager
+    def attached_connection(self, db_file, attach_files, readonly=None):
+        """Pooled connection to db_file with attach_files ATTACHed read-only.
+
+        Yields (conn, aliases); aliases maps each attached path to its schema
+        name so one statement can join across files, e.g. user_bookmarks
+        JOIN "qbank_3rd_year".qbank. Attachments stay on the pooled
+        connection for later checkouts and are redone after close_pool().
+        """
+        attach_files = [os.path.abspath(path) for path in dict.fromkeys(attach_files)]
+        if len(attach_files) > MAX_ATTACHED_DATABASES:
+            raise ValueError(f"Cannot attach {len(attach_files)} databases (limit {MAX_ATTACHED_DATABASES})")
+
+        with self.connection(db_file, readonly) as conn:
+            yield conn, self._attach(conn, attach_files)
     
     def safe_table_name(self, table_name):
         """Safely quote table names for SQL queries"""
@@ -236,6 +1307,334 @@ class DynamicDatabaseHandler:
             '''
         }
     
+    def get_qbank_indexes(self):
+        """Expression indexes for the LOWER(subject)/topic lookups used by content pages"""
+        return {
+            'idx_qbank_subject_topic_id': '''
+                CREATE INDEX IF NOT EXISTS idx_qbank_subject_topic_id
+                ON qbank (LOWER(subject), topic, id)
+            ''',
+            'idx_qbank_subject_chapter_topic': '''
+                CREATE INDEX IF NOT EXISTS idx_qbank_subject_chapter_topic
+                ON qbank (LOWER(subject), chapter, topic)
+            ''',
+        }
+
+    def get_qbank_search_index(self):
+        """FTS5 index over qbank question/answer text (external content, synced by triggers)"""
+        return {
+            'ddl': {
+                'qbank_fts': '''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS qbank_fts USING fts5(
+                        question, answer,
+                        content='qbank', content_rowid='id',
+                        tokenize='porter unicode61'
+                    )
+                ''',
+                'qbank_fts_insert': '''
+                    CREATE TRIGGER IF NOT EXISTS qbank_fts_insert AFTER INSERT ON qbank BEGIN
+                        INSERT INTO qbank_fts (rowid, question, answer)
+                        VALUES (new.id, new.question, new.answer);
+                    END
+                ''',
+                'qbank_fts_delete': '''
+                    CREATE TRIGGER IF NOT EXISTS qbank_fts_delete AFTER DELETE ON qbank BEGIN
+                        INSERT INTO qbank_fts (qbank_fts, rowid, question, answer)
+                        VALUES ('delete', old.id, old.question, old.answer);
+                    END
+                ''',
+                'qbank_fts_update': '''
+                    CREATE TRIGGER IF NOT EXISTS qbank_fts_update AFTER UPDATE OF id, question, answer ON qbank BEGIN
+                        INSERT INTO qbank_fts (qbank_fts, rowid, question, answer)
+                        VALUES ('delete', old.id, old.question, old.answer);
+                        INSERT INTO qbank_fts (rowid, question, answer)
+                        VALUES (new.id, new.question, new.answer);
+                    END
+                ''',
+            },
+            # Run when the named table is created, to fill it from existing rows
+            'rebuild': {
+                'qbank_fts': ["INSERT INTO qbank_fts (qbank_fts) VALUES ('rebuild')"],
+            },
+        }
+
+    def get_mcq_search_index(self):
+        """FTS5 index over MCQ text plus precomputed facet counts, both kept in sync by triggers"""
+        text_columns = ('question', 'option_a', 'option_b', 'option_c', 'option_d', 'explanation')
+        columns = ', '.join(text_columns)
+
+        def text_values(ref):
+            return ', '.join(f'{ref}.{column}' for column in text_columns)
+
+        def facet_values(ref):
+            return ', '.join(f"('{facet}', COALESCE(CAST({ref}.{facet} AS TEXT), ''))" for facet in MCQ_FACETS)
+
+        def add_facets(ref):
+            return f'''
+                INSERT INTO mcq_facet_counts (facet, value, count)
+                SELECT column1, column2, 1 FROM (VALUES {facet_values(ref)}) WHERE true
+                ON CONFLICT (facet, value) DO UPDATE SET count = count + 1;
+            '''
+
+        def remove_facets(ref):
+            return f'''
+                UPDATE mcq_facet_counts SET count = count - 1
+                WHERE (facet, value) IN (VALUES {facet_values(ref)});
+                DELETE FROM mcq_facet_counts WHERE count <= 0;
+            '''
+
+        facet_counts_sql = ' UNION ALL '.join(
+            f"SELECT '{facet}', COALESCE(CAST({facet} AS TEXT), ''), COUNT(*) FROM mcq_questions GROUP BY 2"
+            for facet in MCQ_FACETS
+        )
+        # Facet columns missing from older MCQ files are added by get_mcq_migrations()
+        return {
+            'ddl': {
+                'mcq_fts': f'''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS mcq_fts USING fts5(
+                        {columns},
+                        content='mcq_questions', content_rowid='id',
+                        tokenize='porter unicode61'
+                    )
+                ''',
+                'mcq_facet_counts': '''
+                    CREATE TABLE IF NOT EXISTS mcq_facet_counts (
+                        facet TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        count INTEGER NOT NULL,
+                        PRIMARY KEY (facet, value)
+                    ) WITHOUT ROWID
+                ''',
+                'mcq_search_insert': f'''
+                    CREATE TRIGGER IF NOT EXISTS mcq_search_insert AFTER INSERT ON mcq_questions BEGIN
+                        INSERT INTO mcq_fts (rowid, {columns}) VALUES (new.id, {text_values('new')});
+                        {add_facets('new')}
+                    END
+                ''',
+                'mcq_search_delete': f'''
+                    CREATE TRIGGER IF NOT EXISTS mcq_search_delete AFTER DELETE ON mcq_questions BEGIN
+                        INSERT INTO mcq_fts (mcq_fts, rowid, {columns}) VALUES ('delete', old.id, {text_values('old')});
+                        {remove_facets('old')}
+                    END
+                ''',
+                'mcq_fts_update': f'''
+                    CREATE TRIGGER IF NOT EXISTS mcq_fts_update AFTER UPDATE OF id, {columns} ON mcq_questions BEGIN
+                        INSERT INTO mcq_fts (mcq_fts, rowid, {columns}) VALUES ('delete', old.id, {text_values('old')});
+                        INSERT INTO mcq_fts (rowid, {columns}) VALUES (new.id, {text_values('new')});
+                    END
+                ''',
+                'mcq_facets_update': f'''
+                    CREATE TRIGGER IF NOT EXISTS mcq_facets_update AFTER UPDATE OF {', '.join(MCQ_FACETS)} ON mcq_questions BEGIN
+                        {remove_facets('old')}
+                        {add_facets('new')}
+                    END
+                ''',
+            },
+            'rebuild': {
+                'mcq_fts': ["INSERT INTO mcq_fts (mcq_fts) VALUES ('rebuild')"],
+                'mcq_facet_counts': [
+                    'DELETE FROM mcq_facet_counts',
+                    f'INSERT INTO mcq_facet_counts (facet, value, count) {facet_counts_sql}',
+                ],
+            },
+        }
+
+    def _create_search_index(self, conn, search_index, existing):
+        """Create the missing search tables/triggers; new tables are filled from existing rows"""
+        created = []
+        for name, create_sql in search_index['ddl'].items():
+            if name not in existing:
+                conn.execute(create_sql)
+                created.append(name)
+        for name, statements in search_index.get('rebuild', {}).items():
+            if name in created:
+                for sql in statements:
+                    conn.execute(sql)
+        return created
+
+    def get_mcq_migrations(self):
+        """Versioned schema changes for MCQ databases (see migrate).
+
+        Append only: entry N brings a file to PRAGMA user_version N.
+        """
+        return [
+            ('mcq_tests_filters', {
+                'columns': {
+                    'mcq_tests': {
+                        'topic_filter': 'TEXT',
+                        'difficulty_filter': 'TEXT',
+                        'created_by': 'INTEGER',
+                        'is_public': 'INTEGER DEFAULT 1',
+                    },
+                },
+            }),
+            ('mcq_questions_metadata', {
+                'columns': {
+                    'mcq_questions': {
+                        'chapter': 'TEXT',
+                        'year_of_question': 'INTEGER',
+                        'source': 'TEXT',
+                        'explanation': 'TEXT',
+                        'difficulty': "TEXT DEFAULT 'medium'",
+                    },
+                },
+            }),
+        ]
+
+    def get_test_migrations(self):
+        """Versioned schema changes for test databases (see migrate).
+
+        test_content_version is bumped by triggers on every test_info /
+        test_questions change, so caches of test content are not invalidated
+        by submissions written to the same file.
+        """
+        version_triggers = [
+            f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE test_content_version SET version = version + 1;
+                END
+            '''
+            for table in ('test_info', 'test_questions')
+            for event in ('INSERT', 'UPDATE', 'DELETE')
+        ]
+        return [
+            ('test_content_version', {
+                'sql': [
+                    '''
+                        CREATE TABLE IF NOT EXISTS test_content_version (
+                            id INTEGER PRIMARY KEY CHECK (id = 1),
+                            version INTEGER NOT NULL
+                        )
+                    ''',
+                    'INSERT OR IGNORE INTO test_content_version (id, version) VALUES (1, 0)',
+                    *version_triggers,
+                ],
+            }),
+        ]
+
+    def _add_missing_columns(self, conn, table, columns, schema=None):
+        """ALTER TABLE ADD COLUMN for each of columns ({name: type}) the table lacks.
+
+        A missing table is created first from schema (the category's
+        CREATE TABLE statements), so the step never counts as applied
+        without the table having its columns.
+        """
+        present = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()}
+        if not present:
+            if table not in (schema or {}):
+                raise sqlite3.OperationalError(f"no such table: {table}")
+            conn.execute(schema[table])
+            present = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()}
+        added = []
+        for column, column_type in columns.items():
+            if column not in present:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+                added.append(f'{table}.{column}')
+        return added
+
+    def migrate(self, db_file, category=None):
+        """Apply the category's pending migrations to db_file; returns their names.
+
+        PRAGMA user_version holds the number of migrations already applied.
+        Each migration runs in its own transaction together with the version
+        bump. Columns that already exist are skipped, so files patched by the
+        old ALTER-on-request code migrate cleanly; missing tables are created
+        from the category schema.
+        """
+        category = category or self.get_category_for_file(db_file)
+        category_info = self.db_categories.get(category, {})
+        migrations = category_info.get('migrations')
+        if not migrations:
+            return []
+
+        applied = []
+        with self.connection(db_file, readonly=False) as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, (name, migration) in enumerate(migrations, start=1):
+                if number <= version:
+                    continue
+                conn.execute('BEGIN')
+                try:
+                    for table, columns in migration.get('columns', {}).items():
+                        self._add_missing_columns(conn, table, columns, category_info.get('schema'))
+                    for sql in migration.get('sql', []):
+                        conn.execute(sql)
+                    conn.execute(f'PRAGMA user_version = {number}')
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                applied.append(name)
+
+        if applied:
+            print(f"Migrated {db_file}: {', '.join(applied)}")
+        return applied
+
+    def ensure_indexes(self, db_file, category=None):
+        """Migrate db_file, create the category's missing indexes (and FTS search index) and ANALYZE it.
+
+        Returns True if anything changed. Each file is checked once per
+        process; close_pool() resets the check.
+        """
+        category = category or self.get_category_for_file(db_file)
+        category_info = self.db_categories.get(category, {})
+        migrations = category_info.get('migrations')
+        indexes = category_info.get('indexes') or {}
+        search_index = category_info.get('search_index')
+        path = os.path.abspath(db_file)
+        if not (migrations or indexes or search_index) or path in self._indexed_files:
+            return False
+
+        with self._ensure_lock:
+            if path in self._indexed_files:     # done by a concurrent request
+                return False
+            created = []
+            try:
+                # Migrations first: search triggers reference migrated columns
+                migrated = self.migrate(db_file, category)
+                with self.connection(db_file, readonly=False) as conn:
+                    existing = {row['name'] for row in conn.execute(
+                        "SELECT name FROM sqlite_master"
+                    ).fetchall()}
+                    for index_name, create_sql in indexes.items():
+                        if index_name not in existing:
+                            conn.execute(create_sql)
+                            created.append(index_name)
+                    if search_index:
+                        created += self._create_search_index(conn, search_index, existing)
+                    if created:
+                        conn.execute('ANALYZE')
+            except Exception as e:
+                print(f"Error migrating/indexing {db_file}: {e}")
+                return False
+
+            self._indexed_files.add(path)
+            if created:
+                print(f"Created indexes on {db_file}: {', '.join(created)}")
+            return bool(migrated or created)
+
+    def ensure_discovered_indexes(self):
+        """ensure_indexes() for every discovered database; True if any changed"""
+        changed = False
+        for category, databases in self.discovered_databases.items():
+            for db_info in databases:
+                if self.ensure_indexes(db_info['file'], category):
+                    changed = True
+        return changed
+
+    def get_query_plans(self, db_file):
+        """EXPLAIN QUERY PLAN for the hot qbank queries against one database"""
+        plans = []
+        with self.connection(db_file) as conn:
+            for label, sql, params in QBANK_HOT_QUERIES:
+                try:
+                    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+                    plan = [row['detail'] for row in rows]
+                except sqlite3.Error as e:
+                    plan = [f"Error: {e}"]
+                plans.append({'label': label, 'sql': sql, 'plan': plan})
+        return plans
+
     def get_centralized_user_schema(self):
         """Schema for centralized user database - ALL USER DATA"""
         return {
@@ -326,6 +1725,8 @@ class DynamicDatabaseHandler:
                     correct_answer TEXT NOT NULL,
                     explanation TEXT,
                     difficulty TEXT DEFAULT 'medium',
+                    year_of_question INTEGER,
+                    source TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''',
@@ -335,8 +1736,12 @@ class DynamicDatabaseHandler:
                     user_id INTEGER NOT NULL,
                     test_name TEXT NOT NULL,
                     subject TEXT NOT NULL,
+                    topic_filter TEXT,
+                    difficulty_filter TEXT,
                     total_questions INTEGER NOT NULL,
                     duration_minutes INTEGER NOT NULL,
+                    created_by INTEGER,
+                    is_public INTEGER DEFAULT 1,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''',
@@ -432,8 +1837,11 @@ class DynamicDatabaseHandler:
             conn.commit()
             conn.close()
 
+            self.ensure_indexes(db_file, category)
+
             # Refresh discovered databases
             self.discovered_databases = self.discover_databases()
+            self.invalidate_catalog()
 
             return True, f"Database {db_file} created successfully"
 
@@ -501,8 +1909,11 @@ class DynamicDatabaseHandler:
             
             conn.close()
             
+            self.ensure_indexes(full_path, category)
+            
             # Refresh discovered databases
             self.discovered_databases = self.discover_databases()
+            self.invalidate_catalog()
             
             return True, f"Database {filename} uploaded successfully"
             
@@ -666,111 +2077,20 @@ def migrate_all_users_to_centralized_db():
 
 # INTEGRATION FUNCTIONS FOR APP.PY
 def get_all_qbank_subjects():
-    """Get all subjects from all discovered QBank databases"""
-    all_subjects = {}
-    
-    # Refresh discovery first
-    dynamic_db_handler.discovered_databases = dynamic_db_handler.discover_databases()
-    
-    # Get all QBank databases
-    qbank_databases = dynamic_db_handler.discovered_databases.get('qbank', [])
-    
-    for db_info in qbank_databases:
-        db_file = db_info['file']
-        try:
-            conn = dynamic_db_handler.get_connection(db_file)
-            
-            # Get subjects from this database
-            subjects = conn.execute('''
-                SELECT DISTINCT subject, COUNT(*) as question_count
-                FROM qbank 
-                GROUP BY subject 
-                ORDER BY subject
-            ''').fetchall()
-            
-            for subject_row in subjects:
-                subject = subject_row['subject']
-                if subject not in all_subjects:
-                    all_subjects[subject] = []
-                
-                all_subjects[subject].append({
-                    'database': db_file,
-                    'question_count': subject_row['question_count']
-                })
-            
-            conn.close()
-        except Exception as e:
-            print(f"Error reading subjects from {db_file}: {e}")
-    
-    return all_subjects
+    """Get all subjects from all discovered QBank databases (served from the catalog)"""
+    return dynamic_db_handler.get_qbank_subjects()
 
 
 def get_goal_qbank_subjects(goal_key=None):
     """Get subjects only from qbank DBs for a specific goal (by filename prefix)."""
-    all_subjects = {}
-
-    # Refresh discovery
-    dynamic_db_handler.discovered_databases = dynamic_db_handler.discover_databases()
-    qbank_databases = dynamic_db_handler.discovered_databases.get('qbank', [])
-
-    prefix = f"{goal_key}_" if goal_key else None
+    return dynamic_db_handler.get_qbank_subjects(goal_key)
 
-    for db_info in qbank_databases:
-        db_file = db_info['file']
 
-        # If a goal is set, skip DBs from other goals
-        if prefix and not os.path.basename(db_file).startswith(prefix):
-            continue
-
-        try:
-            conn = dynamic_db_handler.get_connection(db_file)
-            subjects = conn.execute('''
-                SELECT DISTINCT subject, COUNT(*) as question_count
-                FROM qbank
-                GROUP BY subject
-                ORDER BY subject
-            ''').fetchall()
-
-            for row in subjects:
-                subject = row['subject']
-                if subject not in all_subjects:
-                    all_subjects[subject] = []
-                all_subjects[subject].append({
-                    'database': db_file,
-                    'question_count': row['question_count']
-                })
-            conn.close()
-        except Exception as e:
-            print(f"Error reading subjects from {db_file}: {e}")
-
-    return all_subjects
-
-
-def find_subject_database(subject_name):
-    """Find which database contains a specific subject"""
-    # Refresh discovery
-    dynamic_db_handler.discovered_databases = dynamic_db_handler.discover_databases()
-    
-    qbank_databases = dynamic_db_handler.discovered_databases.get('qbank', [])
-    
-    for db_info in qbank_databases:
-        db_file = db_info['file']
-        try:
-            conn = dynamic_db_handler.get_connection(db_file)
-            
-            # Check if subject exists in this database
-            result = conn.execute('''
-                SELECT COUNT(*) as count 
-                FROM qbank 
-                WHERE LOWER(subject) = ?
-            ''', (subject_name.lower(),)).fetchone()
-            
-            conn.close()
-            
-            if result['count'] > 0:
-                return db_file
-        except Exception as e:
-            print(f"Error checking subject in {db_file}: {e}")
+def find_subject_database(subject_name, goal_key=None):
+    """Find which database contains a specific subject (served from the cached routing index)"""
+    db_file = dynamic_db_handler.lookup_subject_database(subject_name, goal_key)
+    if db_file:
+        return db_file
     
     # Default fallback
     return '/var/data/1st_year.db'
@@ -1045,7 +2365,7 @@ def register_dynamic_db_routes(app, ensure_user_session_func):
     def edit_database_record(db_file, table_name, record_id):
         """FIXED: Edit a specific record with robust error handling"""
         try:
-            conn = dynamic_db_handler.get_connection(db_file)
+            conn = dynamic_db_handler.get_connection(db_file, readonly=False)
             safe_name = dynamic_db_handler.safe_table_name(table_name)
             
             if request.method == 'POST':
@@ -1082,6 +2402,8 @@ def register_dynamic_db_routes(app, ensure_user_session_func):
                     conn.commit()
                     flash('Record updated successfully!', 'success')
                     conn.close()
+                    if table_name == 'qbank':
+                        dynamic_db_handler.refresh_catalog_file(db_file)
                     return redirect(url_for('edit_database_table', db_file=db_file, table_name=table_name))
             
             # GET request - get record and schema
@@ -1123,7 +2445,7 @@ def register_dynamic_db_routes(app, ensure_user_session_func):
             fullpath = os.path.join(BASE_DATA_DIR, filename)
 
 
-            conn = dynamic_db_handler.get_connection(fullpath)
+            conn = dynamic_db_handler.get_connection(fullpath, readonly=False)
             safe_name = dynamic_db_handler.safe_table_name(table_name)
             
             if request.method == 'POST':
@@ -1147,6 +2469,7 @@ def register_dynamic_db_routes(app, ensure_user_session_func):
                     print(f"With values: {values}")
                     
                     cursor = conn.execute(insert_query, values)
+                    new_record_id = cursor.lastrowid
                     
                     # Log the action
                     try:
@@ -1161,6 +2484,10 @@ def register_dynamic_db_routes(app, ensure_user_session_func):
                     conn.commit()
                     flash('Record added successfully!', 'success')
                     conn.close()
+                    if table_name == 'qbank':
+                        dynamic_db_handler.refresh_catalog_file(fullpath)
+                    elif table_name == 'test_info':
+                        dynamic_db_handler.register_test(fullpath, new_record_id)
                     return redirect(url_for('edit_database_table', db_file=db_file, table_name=table_name))
                 else:
                     flash('Please fill at least one field', 'error')
@@ -1208,10 +2535,12 @@ def register_dynamic_db_routes(app, ensure_user_session_func):
                 shutil.copy2(db_file, os.path.join(backup_dir, os.path.basename(db_file)))
                 
                 # Delete the database
+                dynamic_db_handler.close_pool(db_file)
                 os.remove(db_file)
                 
                 # Refresh discovered databases
                 dynamic_db_handler.discovered_databases = dynamic_db_handler.discover_databases()
+                dynamic_db_handler.invalidate_catalog()
                 
                 flash(f'Database {db_file} deleted successfully. Backup saved to {backup_dir}', 'success')
             else:
@@ -1222,6 +2551,45 @@ def register_dynamic_db_routes(app, ensure_user_session_func):
         
         return redirect(url_for('dynamic_db_home'))
     
+    @app.route('/admin/db_pool_stats')
+    def db_pool_stats():
+        """Connection pool metrics (size, hit rate, wait time) per database"""
+        return jsonify(dynamic_db_handler.get_pool_stats())
+
+    @app.route('/admin/query_plans')
+    def query_plans():
+        """EXPLAIN QUERY PLAN for the hot qbank queries on every qbank database"""
+        dynamic_db_handler.refresh_catalog(force=True)
+
+        sections = []
+        for db_info in dynamic_db_handler.discovered_databases.get('qbank', []):
+            db_file = db_info['file']
+            try:
+                plans = dynamic_db_handler.get_query_plans(db_file)
+            except Exception as e:
+                sections.append(f"<h3>{db_info['name']}</h3><p>Error: {e}</p>")
+                continue
+
+            rows = ''.join(
+                f"<tr><td>{p['label']}</td><td><code>{p['sql']}</code></td>"
+                f"<td><pre>{'<br>'.join(p['plan'])}</pre></td></tr>"
+                for p in plans
+            )
+            sections.append(f"""
+            <h3>{db_info['name']}</h3>
+            <table border="1" cellpadding="4">
+                <tr><th>Query</th><th>SQL</th><th>Plan</th></tr>
+                {rows}
+            </table>
+            """)
+
+        return f"""
+        <h2>qbank Query Plans</h2>
+        <p>Plans should read <code>SEARCH qbank USING ... INDEX idx_qbank_...</code>, not <code>SCAN qbank</code>.</p>
+        {''.join(sections) or '<p>No qbank databases found.</p>'}
+        <p><a href="{url_for('dynamic_db_home')}">Back to Database Manager</a></p>
+        """
+
     @app.route('/admin/debug_table/<db_file>/<table_name>')
     def debug_table_access(db_file, table_name):
         """Debug function to diagnose table access issues"""
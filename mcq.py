@@ -3,12 +3,26 @@ from flask import Blueprint, render_template, request, redirect, url_for, sessio
 import sqlite3
 from datetime import datetime, timedelta
 import json
+import os
 import random
-from dynamic_db_handler import dynamic_db_handler
+from functools import lru_cache
+from dynamic_db_handler import dynamic_db_handler, MCQ_FACETS
 # Persistent DB file paths on Render
 USER_DB_FILE = '/var/data/admin_users.db'
 GENERAL_MCQ_DB_FILE = '/var/data/general_mcq.db'
 
+# Largest id list bound into one WHERE id IN (...) query
+SQLITE_MAX_IN_PARAMS = 900
+
+# /mcq/api/search paging
+MCQ_SEARCH_PAGE_SIZE = 20
+MCQ_SEARCH_MAX_PAGE_SIZE = 100
+
+# Practice sessions: questions per batch sent to the page
+PRACTICE_BATCH_SIZE = 10
+PRACTICE_MAX_BATCH_SIZE = 50
+PRACTICE_SESSION_MAX_AGE_DAYS = 7   # unfinished sessions are resumed, older ones deleted
+
 
 
 # Create MCQ Blueprint
@@ -16,28 +30,191 @@ mcq_bp = Blueprint('mcq', __name__, url_prefix='/mcq')
 
 
 # MCQ Database Configuration
-def get_mcq_db_connection(subject=None):
-    """Get connection to appropriate MCQ database"""
+def get_mcq_db_file(subject=None):
+    """Path of the MCQ database for a subject (first MCQ database otherwise), or None"""
+    mcq_databases = dynamic_db_handler.goal_registry.get_databases('mcq')
     if subject:
         # Find MCQ database for specific subject
-        mcq_databases = dynamic_db_handler.discovered_databases.get('mcq', [])
         for db_info in mcq_databases:
-            db_file = db_info['file']
-            if subject.lower() in db_file.lower():
-                return dynamic_db_handler.get_connection(db_file)
-    
+            if subject.lower() in db_info['file'].lower():
+                return db_info['file']
+
     # Default to first available MCQ database
-    mcq_databases = dynamic_db_handler.discovered_databases.get('mcq', [])
-    if mcq_databases:
-        return dynamic_db_handler.get_connection(mcq_databases[0]['file'])
+    return mcq_databases[0]['file'] if mcq_databases else None
+
+
+def get_mcq_db_connection(subject=None, readonly=None):
+    """Get connection to appropriate MCQ database (pass readonly=False to write)"""
+    db_file = get_mcq_db_file(subject)
+    if db_file:
+        return dynamic_db_handler.get_connection(db_file, readonly)
     
     # Fallback: create default MCQ database
     return create_default_mcq_database()
 
 
+# --------------------
+# RANDOM SAMPLING
+# Question ids per (subject, topic, difficulty) are cached while the MCQ
+# file is unchanged; a sample picks k ids from that array in O(k) and
+# only the chosen rows are read.
+# --------------------
+
+
+@lru_cache(maxsize=256)
+def _load_mcq_ids(db_file, subject, topic, difficulty, mtime_ns):
+    query = 'SELECT id FROM mcq_questions WHERE subject = ?'
+    params = [subject]
+    if topic:
+        query += ' AND topic = ?'
+        params.append(topic)
+    if difficulty:
+        query += ' AND difficulty = ?'
+        params.append(difficulty)
+    with dynamic_db_handler.connection(db_file) as conn:
+        return tuple(row[0] for row in conn.execute(query + ' ORDER BY id', params).fetchall())
+
+
+def get_mcq_ids(db_file, subject, topic=None, difficulty=None):
+    """Cached, id-ordered tuple of the question ids matching the filters"""
+    try:
+        mtime_ns = os.stat(db_file).st_mtime_ns
+    except (OSError, TypeError):
+        return ()
+    return _load_mcq_ids(db_file, subject, topic or None, difficulty or None, mtime_ns)
+
+
+def sample_ids(ids, k, seed=None):
+    """k distinct ids in random order via a partial Fisher-Yates shuffle.
+
+    Swaps are kept in a dict instead of copying ids, so the cost is O(k)
+    however large the bank is. The same seed gives the same sample.
+    """
+    rng = random.Random(seed) if seed is not None else random
+    n = len(ids)
+    swapped = {}
+    chosen = []
+    for i in range(min(k, n)):
+        j = rng.randrange(i, n)
+        chosen.append(swapped.get(j, ids[j]))
+        swapped[j] = swapped.get(i, ids[i])
+    return chosen
+
+
+def fetch_mcq_questions(conn, ids):
+    """mcq_questions rows for ids, in the order of ids"""
+    rows = {}
+    for start in range(0, len(ids), SQLITE_MAX_IN_PARAMS):
+        chunk = ids[start:start + SQLITE_MAX_IN_PARAMS]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f'SELECT * FROM mcq_questions WHERE id IN ({placeholders})', chunk).fetchall():
+            rows[row['id']] = row
+    return [rows[question_id] for question_id in ids if question_id in rows]
+
+
+# --------------------
+# PRACTICE SESSIONS (admin_users.db)
+# A practice run stores its shuffled question order server-side; the page
+# pulls questions in batches and gets answers/explanations only after
+# each answer is submitted.
+# --------------------
+
+
+def create_practice_tables():
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS mcq_practice_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                database_file TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                question_ids TEXT NOT NULL,  -- JSON array, in practice order
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS mcq_practice_answers (
+                practice_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                answer TEXT NOT NULL,
+                is_correct INTEGER NOT NULL,
+                answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (practice_id, question_id)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_mcq_practice_sessions_user_topic
+            ON mcq_practice_sessions (user_id, subject, topic, id)
+        ''')
+
+
+@mcq_bp.record_once
+def _init_practice_store(state):
+    create_practice_tables()
+
+
+def find_open_practice(user_id, db_file, subject, topic):
+    """Id of the user's latest session for this topic if it is unfinished and unexpired, else None"""
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        row = conn.execute('''
+            SELECT s.id FROM (
+                SELECT id, question_ids, created_at FROM mcq_practice_sessions
+                WHERE user_id = ? AND subject = ? AND topic = ? AND database_file = ?
+                ORDER BY id DESC
+                LIMIT 1
+            ) s
+            WHERE s.created_at >= datetime('now', ?)
+              AND (SELECT COUNT(*) FROM mcq_practice_answers a WHERE a.practice_id = s.id)
+                  < json_array_length(s.question_ids)
+        ''', (user_id, subject, topic, db_file, f'-{PRACTICE_SESSION_MAX_AGE_DAYS} days')).fetchone()
+    return row['id'] if row else None
+
+
+def start_practice(user_id, db_file, subject, topic, question_ids):
+    """Store a new session (deleting expired ones) and return its id"""
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        expired = f'-{PRACTICE_SESSION_MAX_AGE_DAYS} days'
+        conn.execute('''
+            DELETE FROM mcq_practice_answers WHERE practice_id IN (
+                SELECT id FROM mcq_practice_sessions WHERE created_at < datetime('now', ?)
+            )
+        ''', (expired,))
+        conn.execute("DELETE FROM mcq_practice_sessions WHERE created_at < datetime('now', ?)", (expired,))
+        cursor = conn.execute('''
+            INSERT INTO mcq_practice_sessions (user_id, database_file, subject, topic, question_ids)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, db_file, subject, topic, json.dumps(question_ids)))
+        return cursor.lastrowid
+
+
+def get_practice(practice_id, user_id):
+    """The user's practice session with question_ids decoded, or None"""
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        row = conn.execute(
+            'SELECT * FROM mcq_practice_sessions WHERE id = ? AND user_id = ?',
+            (practice_id, user_id)
+        ).fetchone()
+    if not row:
+        return None
+    practice = dict(row)
+    practice['question_ids'] = json.loads(practice['question_ids'])
+    return practice
+
+
+def get_practice_answers(practice_id):
+    """{question_id: (answer, is_correct)} for a practice session"""
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        return {row['question_id']: (row['answer'], row['is_correct'])
+                for row in conn.execute(
+                    'SELECT question_id, answer, is_correct FROM mcq_practice_answers WHERE practice_id = ?',
+                    (practice_id,)
+                ).fetchall()}
+
+
 def get_user_db_connection():
-    """Get centralized user database connection"""
-    return sqlite3.connect(USER_DB_FILE)
+    """Get centralized user database connection (pooled)"""
+    return dynamic_db_handler.get_connection(USER_DB_FILE)
 
 def create_default_mcq_database():
     """Create a default MCQ database if none exists"""
@@ -111,7 +288,7 @@ def ensure_user_session():
 def debug_mcq_database_schema():
     """Debug MCQ database schema and fix missing columns"""
     try:
-        conn = get_mcq_db_connection()
+        conn = get_mcq_db_connection(readonly=False)
         
         debug_output = []
         debug_output.append("🔍 MCQ Database Debug Information:")
@@ -196,85 +373,6 @@ def debug_mcq_database_schema():
         return f"Debug error: {str(e)}"
 
 
-def fix_mcq_schema_immediately():
-    """Quick fix for missing difficulty_filter column"""
-    try:
-        conn = get_mcq_db_connection()
-        
-        # Try to add missing columns
-        missing_columns = [
-            "ALTER TABLE mcq_tests ADD COLUMN topic_filter TEXT",
-            "ALTER TABLE mcq_tests ADD COLUMN difficulty_filter TEXT", 
-            "ALTER TABLE mcq_tests ADD COLUMN created_by INTEGER",
-            "ALTER TABLE mcq_tests ADD COLUMN is_public INTEGER DEFAULT 1"
-        ]
-        
-        for sql in missing_columns:
-            try:
-                conn.execute(sql)
-                print(f"✅ Executed: {sql}")
-            except sqlite3.OperationalError as e:
-                if "duplicate column name" not in str(e):
-                    print(f"❌ Error: {e}")
-        
-        conn.commit()
-        conn.close()
-        return True
-        
-    except Exception as e:
-        print(f"Error fixing schema: {e}")
-        return False
-
-
-def fix_mcq_questions_schema():
-    """Fix missing columns in mcq_questions table"""
-    try:
-        conn = get_mcq_db_connection()
-        
-        # Add missing columns for mcq_questions table, including chapter
-        missing_columns = [
-            "ALTER TABLE mcq_questions ADD COLUMN chapter TEXT",
-            "ALTER TABLE mcq_questions ADD COLUMN year_of_question INTEGER",
-            "ALTER TABLE mcq_questions ADD COLUMN source TEXT",
-            "ALTER TABLE mcq_questions ADD COLUMN explanation TEXT",
-            "ALTER TABLE mcq_questions ADD COLUMN difficulty TEXT DEFAULT 'medium'"
-        ]
-        
-        for sql in missing_columns:
-            try:
-                conn.execute(sql)
-                print(f"✅ Executed: {sql}")
-            except sqlite3.OperationalError as e:
-                if "duplicate column name" not in str(e):
-                    print(f"❌ Error: {e}")
-                else:
-                    print(f"✅ Column already exists: {sql.split()[-2]}")
-        
-        conn.commit()
-        conn.close()
-        return True
-        
-    except Exception as e:
-        print(f"Error fixing mcq_questions schema: {e}")
-        return False
-
-
-def fix_mcq_database_schema():
-    """Fix missing difficulty_filter column"""
-    try:
-        conn = get_mcq_db_connection()
-        
-        # Try to add the missing column
-        conn.execute("ALTER TABLE mcq_tests ADD COLUMN difficulty_filter TEXT")
-        conn.commit()
-        conn.close()
-        print("✅ Added missing difficulty_filter column")
-        
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            print("✅ Column already exists")
-        else:
-            print(f"❌ Error: {e}")
 def get_mcq_chapters(subject):
     conn = get_mcq_db_connection(subject)
     try:
@@ -321,17 +419,14 @@ def get_chapters_with_topics(subject):
 def get_all_mcq_subjects():
     """Get all subjects from MCQ databases"""
     subjects = set()
-    mcq_databases = dynamic_db_handler.discovered_databases.get('mcq', [])
-    
-    for db_info in mcq_databases:
-        try:
-            conn = dynamic_db_handler.get_connection(db_info['file'])
-            subject_rows = conn.execute('SELECT DISTINCT subject FROM mcq_questions').fetchall()
-            subjects.update([row['subject'] for row in subject_rows])
-            conn.close()
-        except Exception as e:
-            print(f"Error getting subjects from {db_info['file']}: {e}")
-    
+    mcq_files = dynamic_db_handler.goal_registry.get_files('mcq')
+
+    for result in dynamic_db_handler.fan_out(mcq_files, 'SELECT DISTINCT subject FROM mcq_questions'):
+        if result.error:
+            print(f"Error getting subjects from {result.db_file}: {result.error}")
+            continue
+        subjects.update([row['subject'] for row in result.value])
+
     return sorted(list(subjects))
 
 
@@ -359,13 +454,6 @@ def get_mcq_topics(subject):
 @mcq_bp.route('/')
 def mcq_home():
     """MCQ Home page showing all subjects"""
-    # Auto-fix schema issues for both tables
-    try:
-        fix_mcq_schema_immediately()    # For tests table
-        fix_mcq_questions_schema()      # For questions table (NEW)
-    except Exception as e:
-        print(f"Schema fix error: {e}")
-    
     subjects = get_all_mcq_subjects()
     
     # Get question counts for each subject
@@ -422,26 +510,134 @@ def mcq_practice_topic(subject_name, topic_name):
         flash('Please login to practice MCQs', 'info')
         return redirect(url_for('login'))
     
-    # Get questions for this topic
-    conn = get_mcq_db_connection(subject_name)
-    try:
-        questions = conn.execute('''
-            SELECT * FROM mcq_questions 
-            WHERE subject = ? AND topic = ?
-            ORDER BY RANDOM()
-        ''', (subject_name, topic_name)).fetchall()
-        
-        if not questions:
-            flash('No MCQ questions found for this topic', 'warning')
-            return redirect(url_for('mcq.mcq_subject', subject_name=subject_name))
-        
-    finally:
-        conn.close()
-    
+    # Get questions for this topic: shuffle the cached ids, read only those rows
+    db_file = get_mcq_db_file(subject_name)
+    ids = get_mcq_ids(db_file, subject_name, topic_name)
+    if not ids:
+        flash('No MCQ questions found for this topic', 'warning')
+        return redirect(url_for('mcq.mcq_subject', subject_name=subject_name))
+
+    # A reload resumes the open session; ?new=1 (or an explicit ?seed) starts over
+    seed = request.args.get('seed', type=int)
+    practice = None
+    if seed is None and not request.args.get('new'):
+        practice_id = find_open_practice(user_id, db_file, subject_name, topic_name)
+        practice = get_practice(practice_id, user_id) if practice_id else None
+    start_question = 1
+    if practice:
+        order = practice['question_ids']
+        answers = get_practice_answers(practice_id)
+        start_question = next((position for position, question_id in enumerate(order, start=1)
+                               if question_id not in answers), 1)
+    else:
+        order = sample_ids(ids, len(ids), seed=seed)
+        practice_id = start_practice(user_id, db_file, subject_name, topic_name, order)
+
+    # The page loads questions in batches from api_practice_questions
     return render_template('mcq/mcq_practice.html', 
                          subject=subject_name,
                          topic=topic_name,
-                         questions=questions)
+                         practice_id=practice_id,
+                         total_questions=len(order),
+                         start_question=start_question,
+                         batch_size=PRACTICE_BATCH_SIZE)
+
+
+@mcq_bp.route('/api/practice/<int:practice_id>/questions')
+def api_practice_questions(practice_id):
+    """A batch of practice questions (?offset=&limit=) without answers or explanations"""
+    user_id = ensure_user_session()
+    practice = get_practice(practice_id, user_id) if user_id else None
+    if not practice:
+        return jsonify({'error': 'Practice session not found'}), 404
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', PRACTICE_BATCH_SIZE, type=int)
+    limit = min(max(limit, 1), PRACTICE_MAX_BATCH_SIZE)
+    batch_ids = practice['question_ids'][offset:offset + limit]
+
+    with dynamic_db_handler.connection(practice['database_file']) as conn:
+        rows = fetch_mcq_questions(conn, batch_ids)
+    answers = get_practice_answers(practice_id)
+
+    positions = {question_id: offset + i + 1 for i, question_id in enumerate(batch_ids)}
+    questions = []
+    for row in rows:
+        question = {
+            'position': positions[row['id']],
+            'id': row['id'],
+            'question': row['question'],
+            'options': {'A': row['option_a'], 'B': row['option_b'],
+                        'C': row['option_c'], 'D': row['option_d']},
+            'answer': None,
+        }
+        if row['id'] in answers:
+            # Already answered (e.g. page reload): the result may be shown again
+            answer, is_correct = answers[row['id']]
+            question['answer'] = {'selected': answer, 'is_correct': bool(is_correct),
+                                  'correct_answer': (row['correct_answer'] or '').strip().upper(),
+                                  'explanation': row['explanation']}
+        questions.append(question)
+
+    return jsonify({
+        'practice_id': practice_id,
+        'total': len(practice['question_ids']),
+        'offset': offset,
+        'score': sum(1 for _, is_correct in answers.values() if is_correct),
+        'questions': questions,
+    })
+
+
+@mcq_bp.route('/api/practice/<int:practice_id>/answer', methods=['POST'])
+def api_practice_answer(practice_id):
+    """Record an answer and return the correct option and explanation for that question"""
+    user_id = ensure_user_session()
+    practice = get_practice(practice_id, user_id) if user_id else None
+    if not practice:
+        return jsonify({'error': 'Practice session not found'}), 404
+
+    data = request.get_json(silent=True) or request.form.to_dict()
+    try:
+        question_id = int(data.get('question_id'))
+    except (TypeError, ValueError):
+        question_id = None
+    selected = str(data.get('answer') or '').strip().upper()
+    if question_id not in practice['question_ids'] or selected not in ('A', 'B', 'C', 'D'):
+        return jsonify({'error': 'Invalid question or answer'}), 400
+
+    with dynamic_db_handler.connection(practice['database_file']) as conn:
+        row = conn.execute(
+            'SELECT correct_answer, explanation FROM mcq_questions WHERE id = ?', (question_id,)
+        ).fetchone()
+    if not row:
+        return jsonify({'error': 'Question not found'}), 404
+
+    correct_answer = (row['correct_answer'] or '').strip().upper()
+    is_correct = selected == correct_answer
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        # The first answer counts; re-submitting only returns the result again
+        conn.execute('''
+            INSERT OR IGNORE INTO mcq_practice_answers (practice_id, question_id, answer, is_correct)
+            VALUES (?, ?, ?, ?)
+        ''', (practice_id, question_id, selected, int(is_correct)))
+        selected, is_correct = conn.execute(
+            'SELECT answer, is_correct FROM mcq_practice_answers WHERE practice_id = ? AND question_id = ?',
+            (practice_id, question_id)
+        ).fetchone()
+        score, answered = conn.execute(
+            'SELECT COALESCE(SUM(is_correct), 0), COUNT(*) FROM mcq_practice_answers WHERE practice_id = ?',
+            (practice_id,)
+        ).fetchone()
+
+    return jsonify({
+        'question_id': question_id,
+        'selected': selected,
+        'is_correct': bool(is_correct),
+        'correct_answer': correct_answer,
+        'explanation': row['explanation'],
+        'score': score,
+        'answered': answered,
+    })
 
 
 @mcq_bp.route('/test/<int:test_id>')
@@ -618,31 +814,19 @@ def create_mcq_test():
         difficulty_filter = request.form.get('difficulty_filter', '')
         num_questions = int(request.form['num_questions'])
         duration = int(request.form['duration'])
+        seed = request.form.get('seed', type=int)  # optional: reproducible question selection
         
         try:
-            # Get questions based on filters
-            conn = get_mcq_db_connection(subject)
-            
-            query = 'SELECT * FROM mcq_questions WHERE subject = ?'
-            params = [subject]
-            
-            if topic_filter:
-                query += ' AND topic = ?'
-                params.append(topic_filter)
-            
-            if difficulty_filter:
-                query += ' AND difficulty = ?'
-                params.append(difficulty_filter)
-            
-            query += ' ORDER BY RANDOM() LIMIT ?'
-            params.append(num_questions)
-            
-            questions = conn.execute(query, params).fetchall()
+            # Pick question ids from the cached id array for these filters
+            ids = get_mcq_ids(get_mcq_db_file(subject), subject, topic_filter, difficulty_filter)
+            question_ids = sample_ids(ids, num_questions, seed=seed)
             
-            if len(questions) < num_questions:
-                flash(f'Only {len(questions)} questions available with current filters', 'warning')
+            if len(question_ids) < num_questions:
+                flash(f'Only {len(question_ids)} questions available with current filters', 'warning')
                 return redirect(request.url)
             
+            conn = get_mcq_db_connection(subject, readonly=False)
+            
             # Create test
             cursor = conn.execute('''
                 INSERT INTO mcq_tests (test_name, subject, topic_filter, difficulty_filter, total_questions, duration_minutes, created_by)
@@ -652,11 +836,10 @@ def create_mcq_test():
             test_id = cursor.lastrowid
             
             # Add questions to test
-            for i, question in enumerate(questions):
-                conn.execute('''
-                    INSERT INTO mcq_test_questions (test_id, question_id, question_order)
-                    VALUES (?, ?, ?)
-                ''', (test_id, question['id'], i + 1))
+            conn.executemany('''
+                INSERT INTO mcq_test_questions (test_id, question_id, question_order)
+                VALUES (?, ?, ?)
+            ''', [(test_id, question_id, i + 1) for i, question_id in enumerate(question_ids)])
             
             conn.commit()
             conn.close()
@@ -678,6 +861,25 @@ def api_get_topics(subject):
     return jsonify([{'name': topic['topic'], 'count': topic['question_count']} for topic in topics])
 
 
+@mcq_bp.route('/api/search')
+def api_search():
+    """Paginated MCQ search with facet counts in one response.
+
+    ?q=<text>&subject=&chapter=&topic=&difficulty=&year_of_question=&page=&per_page=
+    """
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', MCQ_SEARCH_PAGE_SIZE, type=int)
+    per_page = min(max(per_page, 1), MCQ_SEARCH_MAX_PAGE_SIZE)
+    filters = {facet: request.args.get(facet) for facet in MCQ_FACETS}
+
+    result = dynamic_db_handler.search_mcq(
+        request.args.get('q', '').strip(),
+        dynamic_db_handler.goal_registry.get_files('mcq'),
+        filters, page, per_page
+    )
+    return jsonify(result)
+
+
 # --------------------
 # ADMIN MCQ ROUTES
 # --------------------
@@ -708,7 +910,7 @@ def admin_add_mcq_question():
             year_of_question = request.form.get('year_of_question')
             source = request.form.get('source', '')
             
-            conn = get_mcq_db_connection(subject)
+            conn = get_mcq_db_connection(subject, readonly=False)
             conn.execute('''
                 INSERT INTO mcq_questions 
                 (subject, chapter, topic, question, option_a, option_b, option_c, option_d, 
@@ -806,7 +1008,7 @@ def debug_add_question():
             debug_info.append("✅ All required fields present")
             
             # Test database connection
-            conn = get_mcq_db_connection(subject)
+            conn = get_mcq_db_connection(subject, readonly=False)
             debug_info.append(f"✅ Database connection established")
             
             # Check table schema
@@ -820,8 +1022,8 @@ def debug_add_question():
             if missing_cols:
                 debug_info.append(f"❌ Missing table columns: {missing_cols}")
                 # Try to fix schema
-                fix_mcq_questions_schema()
-                debug_info.append("🔧 Attempted schema fix")
+                dynamic_db_handler.migrate(get_mcq_db_file(subject), 'mcq')
+                debug_info.append("🔧 Attempted schema migration")
             
             # Test insert query
             debug_info.append("🧪 Attempting to insert question...")
@@ -968,7 +1170,7 @@ def debug_mcq_questions_schema():
         return "Please login to access debug features. <a href='/login'>Login</a>"
     
     try:
-        conn = get_mcq_db_connection()
+        conn = get_mcq_db_connection(readonly=False)
         
         # Get current schema
         schema = conn.execute("PRAGMA table_info(mcq_questions)").fetchall()
@@ -1,7 +1,9 @@
 from flask import Blueprint, render_template, abort, request, redirect, url_for, flash, session, jsonify
 import sqlite3
 import os
-from dynamic_db_handler import dynamic_db_handler
+from collections import namedtuple
+from functools import lru_cache
+from dynamic_db_handler import dynamic_db_handler, db_file_signature
 test_bp = Blueprint('test_bp', __name__, url_prefix='/test', template_folder='templates')
 # then the URL becomes /test/tests
 
@@ -9,6 +11,7 @@ test_bp = Blueprint('test_bp', __name__, url_prefix='/test', template_folder='te
 from dynamic_db_handler import dynamic_db_handler
 
 BASE_TEST_DIR = '/var/data'  # keep if you use it elsewhere
+USER_DB_FILE = '/var/data/admin_users.db'
 
 # Auto-create user_responses if missing
 
@@ -20,17 +23,14 @@ def get_test_db_connection():
 
 
 
-    # Refresh discovery
-    dynamic_db_handler.discovered_databases = dynamic_db_handler.discover_databases()
-    test_databases = dynamic_db_handler.discovered_databases.get('test', [])
-
     # 1) Try to find a test DB whose filename contains the goal key
     if goal_key:
-        for db_info in test_databases:
-            if goal_key.lower() in db_info['file'].lower():
-                conn = dynamic_db_handler.get_connection(db_info['file'])
-                conn.row_factory = sqlite3.Row
-                return conn
+        for db_info in dynamic_db_handler.goal_registry.get_databases('test', goal_key):
+            conn = dynamic_db_handler.get_connection(db_info['file'])
+            conn.row_factory = sqlite3.Row
+            return conn
+
+    test_databases = dynamic_db_handler.goal_registry.get_databases('test')
 
     # 2) Fallback: first available test DB
     if test_databases:
@@ -69,37 +69,308 @@ def get_test_db_connection():
 
 def get_db_connection_for_test(test_id):
     """
-    Find and return the exact database connection where the given test_id exists.
-    This ensures consistency between submit and review.
+    Return a connection to the database where the given test_id exists.
+    Prefers the database chosen in start_test() so submit and review stay
+    consistent; otherwise one locator lookup. None if no database has the test.
     """
-    # Refresh discovered databases
-    dynamic_db_handler.discovered_databases = dynamic_db_handler.discover_databases()
-    test_dbs = dynamic_db_handler.discovered_databases.get('test', [])
-
-    for db_info in test_dbs:
-        try:
-            conn = dynamic_db_handler.get_connection(db_info['file'])
-            conn.row_factory = sqlite3.Row
-            # Check if this test exists in this DB
-            if conn.execute('SELECT 1 FROM test_info WHERE id = ?', (test_id,)).fetchone():
-                return conn  # Found the right one!
-        except Exception as e:
-            print(f"Error checking {db_info['file']}: {e}")
-            if 'conn' in locals():
-                conn.close()
-            continue
-
-    # If not found in any discovered DB, fallback (should rarely happen)
-    conn = get_db_connection_for_test(test_id)  # This already sets row_factory
-    return conn
-def get_session_db(test_id):
-    db_file = session.get(f'test_{test_id}_db_file')
+    attempt = get_attempt(test_id)
+    db_file = dynamic_db_handler.locate_test(test_id, attempt['database_file']) if attempt else None
+    if not db_file:
+        db_file = dynamic_db_handler.locate_test(test_id)
     if not db_file:
         return None
+
     conn = dynamic_db_handler.get_connection(db_file)
     conn.row_factory = sqlite3.Row
     return conn
 
+# -----------------------------
+# Server-side test attempts (admin_users.db, WAL)
+# The cookie only carries test_<id>_attempt; answers, marks and skips
+# live in attempt_answers, one row per question.
+# -----------------------------
+def create_attempt_tables():
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS test_attempts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                test_id INTEGER NOT NULL,
+                database_file TEXT NOT NULL,
+                status TEXT DEFAULT 'in_progress',
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                submitted_at TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS attempt_answers (
+                attempt_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                answer TEXT,
+                is_marked INTEGER DEFAULT 0,
+                is_skipped INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (attempt_id, question_id)
+            ) WITHOUT ROWID
+        ''')
+
+
+@test_bp.record_once
+def _init_attempt_store(state):
+    create_attempt_tables()
+
+
+def start_attempt(test_id, db_file):
+    """Open a new attempt and remember only its id in the session"""
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        attempt_id = conn.execute(
+            'INSERT INTO test_attempts (user_id, test_id, database_file) VALUES (?, ?, ?)',
+            (session.get('user_id', 1), test_id, db_file)
+        ).lastrowid
+    session[f'test_{test_id}_attempt'] = attempt_id
+    return attempt_id
+
+
+def get_attempt(test_id):
+    """The session's in-progress attempt row for test_id, or None"""
+    attempt_id = session.get(f'test_{test_id}_attempt')
+    if not attempt_id:
+        return None
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        return conn.execute(
+            '''SELECT * FROM test_attempts 
+               WHERE id = ? AND test_id = ? AND status = 'in_progress' ''',
+            (attempt_id, test_id)
+        ).fetchone()
+
+
+def load_attempt_state(attempt_id):
+    """(answers {qid_str: option}, marked {qid_str}, skipped {qid_str}) in one query"""
+    answers, marked, skipped = {}, set(), set()
+    if not attempt_id:
+        return answers, marked, skipped
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        rows = conn.execute(
+            'SELECT question_id, answer, is_marked, is_skipped FROM attempt_answers WHERE attempt_id = ?',
+            (attempt_id,)
+        ).fetchall()
+    for row in rows:
+        qid = str(row['question_id'])
+        if row['answer']:
+            answers[qid] = row['answer']
+        if row['is_marked']:
+            marked.add(qid)
+        if row['is_skipped']:
+            skipped.add(qid)
+    return answers, marked, skipped
+
+
+def save_attempt_answer(attempt_id, question_id, answer=None, skipped=False):
+    """Upsert one question's answer (or skip, which clears the answer)"""
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        conn.execute('''
+            INSERT INTO attempt_answers (attempt_id, question_id, answer, is_skipped)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (attempt_id, question_id) DO UPDATE SET
+                answer = excluded.answer,
+                is_skipped = excluded.is_skipped,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (attempt_id, question_id, None if skipped else answer, 1 if skipped else 0))
+
+
+def toggle_attempt_mark(attempt_id, question_id):
+    """Flip the mark-for-review flag; returns the new state"""
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        row = conn.execute('''
+            INSERT INTO attempt_answers (attempt_id, question_id, is_marked)
+            VALUES (?, ?, 1)
+            ON CONFLICT (attempt_id, question_id) DO UPDATE SET
+                is_marked = 1 - is_marked,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING is_marked
+        ''', (attempt_id, question_id)).fetchone()
+    return bool(row['is_marked'])
+
+
+def finish_attempt(test_id, attempt_id):
+    with dynamic_db_handler.connection(USER_DB_FILE) as conn:
+        conn.execute(
+            '''UPDATE test_attempts SET status = 'submitted', submitted_at = CURRENT_TIMESTAMP 
+               WHERE id = ?''',
+            (attempt_id,)
+        )
+    session.pop(f'test_{test_id}_attempt', None)
+
+
+# -----------------------------
+# Per-test question cache
+# Questions of a test only change with test_info/test_questions, so they are
+# cached keyed by (db_file, test_id, content version). The version comes from
+# test_content_version (bumped by triggers, see get_test_migrations), so
+# submissions written to the same file do not evict the paper.
+# -----------------------------
+TestQuestion = namedtuple('TestQuestion', 'id subject topic question option_a option_b option_c option_d correct_answer')
+TestPaper = namedtuple('TestPaper', 'test questions positions answer_key')  # positions: question id -> 1-based q_num
+
+
+@lru_cache(maxsize=64)
+def _load_test_paper(db_file, test_id, version):
+    with dynamic_db_handler.connection(db_file) as conn:
+        test = conn.execute('SELECT * FROM test_info WHERE id = ?', (test_id,)).fetchone()
+        rows = conn.execute(
+            '''SELECT id, subject, topic, question, option_a, option_b, option_c, option_d, correct_answer
+               FROM test_questions WHERE test_id = ? ORDER BY id''',
+            (test_id,)
+        ).fetchall()
+    if not test:
+        return None
+    questions = tuple(TestQuestion(*row) for row in rows)
+    positions = {q.id: position for position, q in enumerate(questions, start=1)}
+    answer_key = tuple((q.correct_answer or '').upper() for q in questions)
+    return TestPaper(dict(test), questions, positions, answer_key)
+
+
+def get_test_content_version(db_file):
+    """Cache key for a test database's questions (None if the file is missing)"""
+    try:
+        with dynamic_db_handler.connection(db_file) as conn:
+            return conn.execute('SELECT version FROM test_content_version').fetchone()[0]
+    except sqlite3.Error:
+        # Not migrated (e.g. read-only file): fall back to the file signature
+        try:
+            return db_file_signature(db_file)
+        except OSError:
+            return None
+
+
+def get_test_paper(db_file, test_id):
+    """Cached TestPaper for a test (None if the test does not exist)"""
+    version = get_test_content_version(db_file)
+    if version is None:
+        return None
+    return _load_test_paper(db_file, test_id, version)
+
+
+def get_attempt_paper(test_id):
+    """(attempt, paper) for the session's in-progress attempt, or (None, None)"""
+    attempt = get_attempt(test_id)
+    if not attempt:
+        return None, None
+    return attempt, get_test_paper(attempt['database_file'], test_id)
+
+
+# -----------------------------
+# Submitted-test summary (per test database)
+# test_completion holds one row per (user, submitted test) so list_tests
+# reads every status with one primary-key join instead of probing
+# user_responses per test.
+# -----------------------------
+def ensure_completion_table(conn):
+    """Create test_completion (backfilled from user_responses) and its supporting index"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='test_completion'"
+    ).fetchone()
+    if not exists:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS test_completion (
+                user_id INTEGER NOT NULL,
+                test_id INTEGER NOT NULL,
+                submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, test_id)
+            ) WITHOUT ROWID
+        ''')
+
+    # Older test databases have user_responses without test_submitted
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(user_responses)').fetchall()}
+    if 'test_submitted' not in columns:
+        return
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_responses_user_test_submitted
+        ON user_responses (user_id, test_id, test_submitted)
+    ''')
+    if not exists:
+        conn.execute('''
+            INSERT OR IGNORE INTO test_completion (user_id, test_id)
+            SELECT DISTINCT user_id, test_id FROM user_responses
+            WHERE test_submitted = 1 AND user_id IS NOT NULL
+        ''')
+
+
+def record_completion(conn, test_id, user_id):
+    conn.execute('''
+        INSERT INTO test_completion (user_id, test_id) VALUES (?, ?)
+        ON CONFLICT (user_id, test_id) DO UPDATE SET submitted_at = CURRENT_TIMESTAMP
+    ''', (user_id, test_id))
+
+
+def get_goal_tests(db_file, user_id):
+    """All tests in one database with the user's submitted flag, in one query"""
+    sql = '''
+        SELECT ti.id, ti.test_name, ti.description, ti.duration_minutes, ti.is_locked,
+               ti.start_time, ti.end_time, ti.created_at,
+               (tc.test_id IS NOT NULL) AS test_submitted
+        FROM test_info ti
+        LEFT JOIN test_completion tc ON tc.test_id = ti.id AND tc.user_id = ?
+        ORDER BY ti.created_at DESC
+    '''
+    try:
+        with dynamic_db_handler.connection(db_file) as conn:
+            return conn.execute(sql, (user_id,)).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'test_completion' not in str(e):
+            raise
+    # First visit since the summary table was introduced: build it once
+    with dynamic_db_handler.connection(db_file, readonly=False) as conn:
+        ensure_completion_table(conn)
+        return conn.execute(sql, (user_id,)).fetchall()
+
+
+# -----------------------------
+# Grading
+# -----------------------------
+def _empty_tally():
+    return {'total': 0, 'correct': 0, 'wrong': 0, 'unanswered': 0}
+
+
+def grade_attempt(paper, answers):
+    """Grade submitted answers against the paper's answer key in one pass.
+
+    answers maps question id (str) -> option letter. Returns a dict with
+    the totals, per-question (question_id, user_answer, is_correct) rows
+    ready for executemany, and per-subject / per-topic breakdowns.
+    """
+    submitted = [answers.get(str(q.id)) for q in paper.questions]
+    scores = [
+        (1 if answer.upper() == key else -1) if answer else 0
+        for answer, key in zip(submitted, paper.answer_key)
+    ]
+
+    by_subject = {}
+    by_topic = {}
+    for q, score in zip(paper.questions, scores):
+        outcome = 'correct' if score > 0 else 'wrong' if score < 0 else 'unanswered'
+        for tally in (by_subject.setdefault(q.subject, _empty_tally()),
+                      by_topic.setdefault((q.subject, q.topic), _empty_tally())):
+            tally['total'] += 1
+            tally[outcome] += 1
+
+    correct = scores.count(1)
+    wrong = scores.count(-1)
+    return {
+        'total': len(scores),
+        'correct': correct,
+        'wrong': wrong,
+        'unanswered': len(scores) - correct - wrong,
+        'responses': [
+            (q.id, answer, 1 if score > 0 else 0)
+            for q, answer, score in zip(paper.questions, submitted, scores)
+        ],
+        'by_subject': by_subject,
+        'by_topic': by_topic,
+    }
+
+
+
 
 @test_bp.route('/tests')
 def list_tests():
@@ -113,23 +384,20 @@ def list_tests():
 
 
 
-    # Get ALL test databases
-    dynamic_db_handler.discovered_databases = dynamic_db_handler.discover_databases()
-    all_test_dbs = dynamic_db_handler.discovered_databases.get('test', [])
-    
-    # FILTER by current goal
-    goal_test_dbs = []
-    if goal_key:
-        for db_info in all_test_dbs:
-            if goal_key.lower() in db_info['file'].lower():
-                goal_test_dbs.append(db_info)
-    else:
-        goal_test_dbs = all_test_dbs  # No goal = show all
+    # Test databases for the current goal (no goal = show all)
+    goal_test_dbs = dynamic_db_handler.goal_registry.get_databases('test', goal_key)
     
     print(f"DEBUG: Goal='{goal_key}', Found {len(goal_test_dbs)} goal-specific test DBs")
     
+    goal_test_files = [db_info['file'] for db_info in goal_test_dbs]
+
     # 🔥 COUNT PREMIUM vs FREE TESTS
-    premium_count = sum(1 for db_info in goal_test_dbs for test_row in dynamic_db_handler.get_connection(db_info['file']).execute('SELECT is_locked FROM test_info').fetchall() if test_row['is_locked'] == 1)
+    premium_count = 0
+    for result in dynamic_db_handler.fan_out(goal_test_files, 'SELECT COUNT(*) FROM test_info WHERE is_locked = 1'):
+        if result.error:
+            print(f"Error counting premium tests in {result.db_file}: {result.error}")
+            continue
+        premium_count += result.value[0][0]
     free_count = len(goal_test_dbs) * 10 - premium_count  # Rough estimate
     print(f"DEBUG: {premium_count}🔒 PREMIUM + {free_count}🚀 FREE tests available")
  
@@ -142,78 +410,27 @@ def list_tests():
 
     all_tests = []
     
-    # Query ONLY goal-specific databases
-    for db_info in goal_test_dbs:
-        try:
-            conn = dynamic_db_handler.get_connection(db_info['file'])
-            conn.row_factory = sqlite3.Row
-            
-            tests = conn.execute('''
-                SELECT ti.id, ti.test_name, ti.description, ti.duration_minutes,
-             
-                    ti.is_locked,              
-                    ti.start_time, ti.end_time, ti.created_at,
-                    CASE WHEN EXISTS (
-                        SELECT 1 FROM user_responses ur 
-                        WHERE ur.test_id = ti.id AND ur.user_id = ? AND ur.test_submitted = 1
-                    ) THEN 1 ELSE 0 END AS test_submitted
-                FROM test_info ti
-                ORDER BY ti.created_at DESC
-                ''', (user_id,)).fetchall()
-
-            
-            # Add DB info
-            for test_row in tests:
-                    test_dict = dict(test_row)
-                    test_dict['database_file'] = os.path.basename(db_info['file'])
-                    
-                    if test_dict.get('is_locked', 0) == 1:
-
-                    # Locked test: only unlock if user subscribed for this goal
-                      # 🔥 FIXED LOCK LOGIC (COMPLETE):
-                     # 🔥 SIMPLE SESSION (No DB needed!)
-                            user_id = session.get('user_id', 1)
-                            user_name = session.get('user_name', session.get('username', f'User#{user_id}'))
-                            user_email = session.get('user_email', f'{user_id}@noemail.com')
-                            user_sub_status = session.get('subscription_status', 'nonsubscribed')
-                            user_sub_goal = session.get('subscription_goal')
-
-                            print(f"👤 {user_id}:{user_name} ({user_email}) → sub='{user_sub_status}' goal='{user_sub_goal}'")
-
-                    
-                    if test_dict.get('is_locked', 0) == 1:
-                        if user_sub_status == 'subscribed' and user_sub_goal == goal_key:
-                            test_dict['effective_locked'] = 0  # Unlock
-                        else:
-                            test_dict['effective_locked'] = 1  # Lock
-                    else:
-                        test_dict['effective_locked'] = 0  # Free
-                    
-                    # ✅ Completion check (KEEP)
-                    
-
-
-                    # 🔥 CHECK COMPLETION IN THIS DB:
-                    user_id = session.get('user_id', 1)
-                    try:
-                        check_conn = dynamic_db_handler.get_connection(db_info['file'])
-                        check_conn.row_factory = sqlite3.Row
-                        result = check_conn.execute('''
-                            SELECT 1 FROM user_responses 
-                            WHERE test_id=? AND user_id=? AND test_submitted=1
-                        ''', (test_dict['id'], user_id)).fetchone()
-                        test_dict['test_submitted'] = 1 if result else 0
-                        check_conn.close()
-                    except:
-                        test_dict['test_submitted'] = 0
-                    
-                    all_tests.append(test_dict)
-
-            
-            conn.close()
-        except Exception as e:
-            print(f"Error in {db_info['file']}: {e}")
-    
+    # Query ONLY goal-specific databases: one pooled query per DB (in parallel), status included
+    for result in dynamic_db_handler.fan_out_map(goal_test_files, lambda db_file: get_goal_tests(db_file, user_id)):
+        if result.error:
+            print(f"Error in {result.db_file}: {result.error}")
+            continue
+
+        for test_row in result.value:
+            test_dict = dict(test_row)
+            test_dict['database_file'] = os.path.basename(result.db_file)
+
+            # Locked test: only unlock if user subscribed for this goal
+            if test_dict.get('is_locked', 0) == 1:
+                if user_sub_status == 'subscribed' and user_sub_goal == goal_key:
+                    test_dict['effective_locked'] = 0  # Unlock
+                else:
+                    test_dict['effective_locked'] = 1  # Lock
+            else:
+                test_dict['effective_locked'] = 0  # Free
+
+            all_tests.append(test_dict)
+
     all_tests.sort(key=lambda t: t.get('created_at', ''), reverse=True)
     
     return render_template('test/tests.html', tests=all_tests)
@@ -222,6 +439,8 @@ def list_tests():
 @test_bp.route('/tests/<int:test_id>/questions')
 def view_test_questions(test_id):
     conn = get_db_connection_for_test(test_id)
+    if not conn:
+        abort(404, description="Test not found")
     try:
         test = conn.execute('SELECT * FROM test_info WHERE id = ?', (test_id,)).fetchone()
         if not test:
@@ -259,19 +478,12 @@ def start_test(test_id):
     if db_file:
         full_path = os.path.join('/var/data', db_file)
         if os.path.exists(full_path):
-            # Verify test exists in this DB
-            conn = dynamic_db_handler.get_connection(full_path)
-            if conn.execute('SELECT 1 FROM test_info WHERE id=?', (test_id,)).fetchone():
-                session[f'test_{test_id}_db_file'] = full_path
-                print(f"✅ start_test(): test_id={test_id} in {db_file}")
-                conn.close()
-                # Initialize sessions
-                session[f'test_{test_id}_answers'] = {}
-                session[f'test_{test_id}_marked'] = []
-                session[f'test_{test_id}_skipped'] = []
+            # Verify test exists in this DB (locator lookup, no probing)
+            if dynamic_db_handler.locate_test(test_id, full_path):
+                attempt_id = start_attempt(test_id, full_path)
+                print(f"✅ start_test(): test_id={test_id} in {db_file} (attempt {attempt_id})")
                 return redirect(url_for('test_bp.single_question', test_id=test_id, q_num=1))
             else:
-                conn.close()
                 flash(f"Test ID {test_id} not found in {db_file}!", "error")
                 return redirect(url_for('test_bp.list_tests'))
         else:
@@ -285,51 +497,27 @@ def start_test(test_id):
 
 @test_bp.route('/tests/<int:test_id>/question/<int:q_num>', methods=['GET', 'POST'])
 def single_question(test_id, q_num):
-    conn = get_session_db(test_id) 
-    if not conn:
-     abort(404)
-    try:
-        questions = conn.execute(
-            '''SELECT id, subject, topic, question, option_a, option_b, option_c, option_d, correct_answer
-               FROM test_questions WHERE test_id = ? ORDER BY id''',
-            (test_id,)
-        ).fetchall()
-        test = conn.execute('SELECT * FROM test_info WHERE id = ?', (test_id,)).fetchone()
-    finally:
-        conn.close()
+    attempt, paper = get_attempt_paper(test_id)
+    if not paper:
+        abort(404)
+    test, questions = paper.test, paper.questions
 
-    if not test or not questions or q_num < 1 or q_num > len(questions):
+    if not questions or q_num < 1 or q_num > len(questions):
         abort(404)
 
     question = questions[q_num - 1]
 
-    answer_key = f'test_{test_id}_answers'
-    mark_key = f'test_{test_id}_marked'
-    skip_key = f'test_{test_id}_skipped'
-
-    if answer_key not in session:
-        session[answer_key] = {}
-    if mark_key not in session:
-        session[mark_key] = []
-    if skip_key not in session:
-        session[skip_key] = []
-
-    answers = session[answer_key]
-    marked = set(session[mark_key])
-    skipped = set(session[skip_key])
+    attempt_id = attempt['id']
+    answers, marked, skipped = load_attempt_state(attempt_id)
+    qid = str(question.id)
 
     if request.method == 'POST':
         selected_option = request.form.get('answer')
         nav = request.form.get('nav')  # previous, next, submit, skip
 
         if nav == 'skip':
-            # Mark the question as skipped
-            skipped.add(str(question['id']))
-            session[skip_key] = list(skipped)
-            # Remove answer if it exists, since it's skipped
-            if str(question['id']) in answers:
-                del answers[str(question['id'])]
-                session[answer_key] = answers
+            # Mark the question as skipped (clears any saved answer)
+            save_attempt_answer(attempt_id, question.id, skipped=True)
             # Navigate forward if possible
             next_q_num = q_num + 1 if q_num < len(questions) else q_num
             return redirect(url_for('test_bp.single_question', test_id=test_id, q_num=next_q_num))
@@ -343,23 +531,18 @@ def single_question(test_id, q_num):
                     question=question,
                     q_num=q_num,
                     total=len(questions),
-                    selected_answer=answers.get(str(question['id']), None),
+                    selected_answer=answers.get(qid, None),
                     marked_questions=marked,
                     skipped_questions=skipped,
                     duration_minutes=test['duration_minutes']
                 )
             # Save answer and remove from skipped if any
-            answers[str(question['id'])] = selected_option
-            session[answer_key] = answers
-            if str(question['id']) in skipped:
-                skipped.remove(str(question['id']))
-                session[skip_key] = list(skipped)
+            save_attempt_answer(attempt_id, question.id, selected_option)
 
         elif nav == 'previous':
             # Save answer if selected before going back
             if selected_option:
-                answers[str(question['id'])] = selected_option
-                session[answer_key] = answers
+                save_attempt_answer(attempt_id, question.id, selected_option)
 
         # Navigate accordingly
         if nav == 'previous':
@@ -377,7 +560,7 @@ def single_question(test_id, q_num):
         question=question,
         q_num=q_num,
         total=len(questions),
-        selected_answer=answers.get(str(question['id']), None),
+        selected_answer=answers.get(qid, None),
         marked_questions=marked,
         skipped_questions=skipped,
         duration_minutes=test['duration_minutes']
@@ -387,52 +570,31 @@ def single_question(test_id, q_num):
 # AJAX toggle mark
 @test_bp.route('/tests/<int:test_id>/question/<int:q_num>/toggle_mark', methods=['POST'])
 def toggle_mark_ajax(test_id, q_num):
-    conn = get_db_connection_for_test(test_id)
-    try:
-        questions = conn.execute('SELECT id FROM test_questions WHERE test_id = ? ORDER BY id', (test_id,)).fetchall()
-    finally:
-        conn.close()
-
-    if not questions or q_num < 1 or q_num > len(questions):
+    # Question ids come from the cached paper - no test database read
+    attempt, paper = get_attempt_paper(test_id)
+    if not attempt and not dynamic_db_handler.locate_test(test_id):
+        return jsonify({'success': False, 'error': 'Test not found'}), 404
+    if not attempt:
+        return jsonify({'success': False, 'error': 'No active attempt'}), 400
+    if not paper:
+        return jsonify({'success': False, 'error': 'Test not found'}), 404
+
+    if not paper.questions or q_num < 1 or q_num > len(paper.questions):
         return jsonify({'success': False, 'error': 'Invalid question'}), 400
 
-    q_id_str = str(questions[q_num - 1]['id'])
-
-    mark_key = f'test_{test_id}_marked'
-    if mark_key not in session:
-        session[mark_key] = []
-    marked = set(session[mark_key])
-
-    if q_id_str in marked:
-        marked.remove(q_id_str)
-        marked_now = False
-    else:
-        marked.add(q_id_str)
-        marked_now = True
-
-    session[mark_key] = list(marked)
+    marked_now = toggle_attempt_mark(attempt['id'], paper.questions[q_num - 1].id)
 
     return jsonify({'success': True, 'marked': marked_now})
 
 
 @test_bp.route('/tests/<int:test_id>/review')
 def review_test(test_id):
-    conn = get_session_db(test_id)
-    try:
-        questions = conn.execute('''SELECT id FROM test_questions WHERE test_id = ? ORDER BY id''', (test_id,)).fetchall()
-        test = conn.execute('SELECT * FROM test_info WHERE id = ?', (test_id,)).fetchone()
-    finally:
-        conn.close()
-    if not test or not questions:
+    attempt, paper = get_attempt_paper(test_id)
+    if not paper or not paper.questions:
         abort(404)
+    test, questions = paper.test, paper.questions
 
-    answer_key = f'test_{test_id}_answers'
-    mark_key = f'test_{test_id}_marked'
-    skip_key = f'test_{test_id}_skipped'
-
-    answers = session.get(answer_key, {})
-    marked = set(session.get(mark_key, []))
-    skipped = set(session.get(skip_key, []))
+    answers, marked, skipped = load_attempt_state(attempt['id'])
 
     return render_template('test/review.html',
                            test=test,
@@ -560,117 +722,68 @@ def review_question(test_id, filter_type, q_index):
 
 @test_bp.route('/tests/<int:test_id>/submit', methods=['GET', 'POST'])
 def submit_test(test_id):
-    print(f"DEBUG SUBMIT: test_id={test_id}")
-    
     if request.method == 'POST' and request.form.get('review') == 'review':
-        print("DEBUG: Redirecting to review")
         return redirect(url_for('test_bp.review_attempted', test_id=test_id))
     
-    # Find CORRECT DB for this test_id (4 lines only)
-    # 🔥 USE SESSION DB (5 lines):
-    db_file = session.get(f'test_{test_id}_db_file')
-    if not db_file or not os.path.exists(db_file):
+    attempt = get_attempt(test_id)
+    db_file = attempt['database_file'] if attempt else None
+    if not db_file or not dynamic_db_handler.locate_test(test_id, db_file):
         flash("Test session expired!", "error")
         return redirect(url_for('test_bp.list_tests'))
 
-    conn = dynamic_db_handler.get_connection(db_file)
-    conn.row_factory = sqlite3.Row
-    print(f"✅ SESSION DB: {os.path.basename(db_file)}")
-
-
-         # 🔥 ADD DEBUG LOCATION (3 lines):
-       
+    paper = get_test_paper(db_file, test_id)
+    if not paper:
+        flash(f"Test ID {test_id} not found!")
+        return redirect(url_for('test_bp.list_tests'))
+    print(f"✅ SESSION DB: {os.path.basename(db_file)} ({len(paper.questions)} questions)")
 
+    user_id = session.get('user_id', 1)
+    answers, marked, skipped = load_attempt_state(attempt['id'])
+    result = grade_attempt(paper, answers)
 
+    conn = dynamic_db_handler.get_connection(db_file, readonly=False)
     try:
-        # DEBUG: Check test exists
-        test = conn.execute('SELECT * FROM test_info WHERE id = ?', (test_id,)).fetchone()
-        print(f"DEBUG: Test found: {test['test_name'] if test else 'NOT FOUND'}")
-        if not test:
-            flash(f"Test ID {test_id} not found!")
-            return redirect(url_for('test_bp.list_tests'))
-        
-        questions = conn.execute(
-            'SELECT id, correct_answer FROM test_questions WHERE test_id = ? ORDER BY id',
-            (test_id,)
-        ).fetchall()
-        print(f"DEBUG: Questions found: {len(questions)}")
-        
-        user_id = session.get('user_id', 1)
-        answer_key = f'test_{test_id}_answers'
-        answers = session.get(answer_key, {})
-        print(f"DEBUG: Session answers: {answers}")
-        
-        for q in questions:
-            qid = str(q['id'])
-            user_answer = answers.get(qid)
-            is_correct = 1 if user_answer and user_answer.upper() == q['correct_answer'].upper() else 0
-            print(f"DEBUG Q{q['id']}: user='{user_answer}', correct='{q['correct_answer']}', score={is_correct}")
-            
+        # One transaction for the table check, every response and the completion marker
+        with conn:
             conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_responses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    test_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    question_id INTEGER,
+                    user_answer TEXT,
+                    is_correct INTEGER,
+                    test_started INTEGER DEFAULT 0,
+                    test_submitted INTEGER DEFAULT 0,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(test_id, user_id, question_id)
+                )
+            ''')
+            conn.executemany('''
                 INSERT OR REPLACE INTO user_responses (test_id, user_id, question_id, user_answer, is_correct, test_started, test_submitted)
                 VALUES (?, ?, ?, ?, ?, 1, 1)
-            ''', (test_id, user_id, q['id'], user_answer, is_correct))
-                    # Insert a durable completion marker (one row per user+test)
-
-            questions = conn.execute(
-            'SELECT id, correct_answer FROM test_questions WHERE test_id = ? ORDER BY id',
-            (test_id,)
-        ).fetchall()
-        print(f"DEBUG: Questions found: {len(questions)}")
-
-            # 🔥 ADD TABLE CREATION HERE:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_responses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                test_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                question_id INTEGER,
-                user_answer TEXT,
-                is_correct INTEGER,
-                test_started INTEGER DEFAULT 0,
-                test_submitted INTEGER DEFAULT 0,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(test_id, user_id, question_id)
-            )
-        ''')
-        conn.commit()
-        print("DEBUG: user_responses table READY")
-        # 🔥 END ADD
-        try:
-            conn.execute('''
-                INSERT OR REPLACE INTO user_responses (test_id, user_id, question_id, test_submitted)
-                VALUES (?, ?, 0, 1)
-            ''', (test_id, user_id))
-            print("✅ FALLBACK marker added")
-        except:
-            print("⚠️ Fallback marker skipped")
-        
-        conn.commit()
-        print("DEBUG: Responses saved")
-
-            
-  
-
-        conn.commit()
-
-
-        print("DEBUG: Responses saved")
-        
-        total = len(questions)
-        correct = sum(1 for q in questions if answers.get(str(q['id'])) 
-                     and answers.get(str(q['id'])).upper() == q['correct_answer'].upper())
-        wrong = sum(1 for q in questions if answers.get(str(q['id'])) 
-                   and answers.get(str(q['id'])).upper() != q['correct_answer'].upper())
-        unanswered = total - correct - wrong
-        
+            ''', [(test_id, user_id, qid, user_answer, is_correct)
+                  for qid, user_answer, is_correct in result['responses']])
+            ensure_completion_table(conn)
+            record_completion(conn, test_id, user_id)
+            # Durable completion marker (one row per user+test); schemas with a
+            # question_id foreign key reject it, which only skips the marker
+            try:
+                conn.execute('''
+                    INSERT OR REPLACE INTO user_responses (test_id, user_id, question_id, test_submitted)
+                    VALUES (?, ?, 0, 1)
+                ''', (test_id, user_id))
+            except sqlite3.Error:
+                print("⚠️ Fallback marker skipped")
     finally:
         conn.close()
 
-    for key in [f'test_{test_id}_answers', f'test_{test_id}_marked', f'test_{test_id}_skipped']:
-        session.pop(key, None)
+    finish_attempt(test_id, attempt['id'])
 
-    return render_template('test/report.html', test=test, total=total, correct=correct, wrong=wrong, unanswered=unanswered)
+    return render_template('test/report.html', test=paper.test,
+                           total=result['total'], correct=result['correct'],
+                           wrong=result['wrong'], unanswered=result['unanswered'],
+                           by_subject=result['by_subject'], by_topic=result['by_topic'])
 
 
     